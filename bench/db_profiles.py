@@ -0,0 +1,129 @@
+# Commits per second and read latency of the stuff/db.py workload under each
+# SQLite profile. fsync costs depend on the disk, so point --dir at the one
+# the bot's data directory lives on.
+#
+#   python -m bench.db_profiles [--spaces 20000] [--commits 500] [--reads 2000] [--dir .]
+#       [--write-behind 0.05] [--batch 100]
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from loguru import logger
+
+from bench.fakes import snowflake
+from stuff import cache, db
+from stuff.pool import PROFILES, Pool
+from stuff.sqlite import SQLiteStorage
+from stuff.writebehind import WriteBehind
+
+
+class Guild:
+    def __init__(self, id):
+        self.id = id
+
+
+async def populate(args):
+    guild_ids = [snowflake() for _ in range(args.guilds)]
+    await db.initialize_db()
+    await db.initialize_guilds([Guild(guild_id) for guild_id in guild_ids])
+    owners = {guild_id: [snowflake() for _ in range(50)] for guild_id in guild_ids}
+    rows = []
+    for _ in range(args.spaces):
+        guild_id = random.choice(guild_ids)
+        rows.append((snowflake(), guild_id, random.choice(owners[guild_id]), 1, 1))
+    await db.storage.upsert_spaces(rows)
+    await db.load_guilds()
+    await db.load_spaces()
+    return guild_ids, owners, rows
+
+
+# Setting toggles, new spaces and owner changes, each its own commit
+async def commits(args, guild_ids, owners, rows):
+    start = time.perf_counter()
+    for i in range(args.commits):
+        guild_id = random.choice(guild_ids)
+        kind = i % 3
+        if kind == 0:
+            guild_db = db.Guild()
+            await guild_db.async_init(guild_id)
+            await guild_db.set_bump(i % 2 == 0)
+        elif kind == 1:
+            await db.Space.add(
+                (snowflake(), guild_id, random.choice(owners[guild_id]), 1, 1)
+            )
+        else:
+            space_id, guild_id, *_ = random.choice(rows)
+            space_db = db.Space()
+            await space_db.async_init(space_id, guild_id)
+            await space_db.set_owner(random.choice(owners[guild_id]))
+    await db.storage.flush()
+    return args.commits / (time.perf_counter() - start)
+
+
+# Space and owner lookups that miss the caches and go to the database
+async def reads(args, owners, rows):
+    cache.spaces.invalidate()
+    latencies = []
+    for i in range(args.reads):
+        space_id, guild_id, *_ = random.choice(rows)
+        start = time.perf_counter()
+        if i % 2:
+            await db.Space().async_init(space_id, guild_id)
+        else:
+            await db.Owner().async_init(guild_id, random.choice(owners[guild_id]))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def run(args, profile, directory):
+    random.seed(args.seed)
+    db.storage = SQLiteStorage(
+        Pool(os.path.join(directory, f"{profile}.db"), readers=1, profile=profile)
+    )
+    if args.write_behind:
+        db.storage = WriteBehind(db.storage, args.write_behind, args.batch)
+    try:
+        guild_ids, owners, rows = await populate(args)
+        rate = await commits(args, guild_ids, owners, rows)
+        latencies = await reads(args, owners, rows)
+    finally:
+        await db.storage.close()
+    return rate, latencies
+
+
+async def main(args):
+    logger.remove()
+    print(
+        f"{args.spaces} spaces in {args.guilds} guilds, {args.commits} commits, "
+        f"{args.reads} reads, write-behind {args.write_behind or 'off'}"
+    )
+    print(
+        f"{'profile':<10} {'commits/s':>10} {'read p50 ms':>12} "
+        f"{'read p99 ms':>12} {'read max ms':>12}"
+    )
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for profile in args.profiles or PROFILES:
+            rate, latencies = await run(args, profile, directory)
+            p50, p99 = (statistics.quantiles(latencies, n=100)[i] for i in (49, 98))
+            print(
+                f"{profile:<10} {rate:>10.0f} {p50:>12.3f} {p99:>12.3f} "
+                f"{max(latencies):>12.3f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--spaces", type=int, default=20000)
+    parser.add_argument("--commits", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--dir", default=None, help="where to put the databases")
+    parser.add_argument("--profiles", nargs="*", choices=list(PROFILES))
+    parser.add_argument("--write-behind", type=float, default=0.0, help="seconds")
+    parser.add_argument("--batch", type=int, default=100, help="writes per flush")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
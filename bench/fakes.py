@@ -0,0 +1,246 @@
+# Lightweight stand-ins for the Discord objects the cogs touch, so hot paths can
+# be driven offline without a gateway connection
+import asyncio
+import itertools
+from datetime import timedelta
+
+import discord
+
+ids = itertools.count(1 << 40)
+
+
+# Snowflake for a moment in time, unique per call
+def snowflake(when=None):
+    when = when or discord.utils.utcnow()
+    return discord.utils.time_snowflake(when) + next(ids) % (1 << 22)
+
+
+class FakeHttp:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self.guilds = {}
+
+    async def bulk_channel_update(self, guild_id, payload, reason=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        channels = self.guilds[guild_id].channels_by_id
+        for entry in payload:
+            channels[entry["id"]].position = entry["position"]
+
+
+class FakeBot:
+    def __init__(self, latency=0.0):
+        self.http = FakeHttp(latency)
+        self.guilds = []
+
+    def get_guild(self, guild_id):
+        return self.http.guilds.get(guild_id)
+
+
+class FakeRole:
+    def __init__(self, guild, name):
+        self.id = snowflake()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<@&{self.id}>"
+
+
+class FakeMember:
+    def __init__(self, guild, pending=False, id=None):
+        self.id = id or snowflake()
+        self.guild = guild
+        self.pending = pending
+        self.roles = []
+        self.display_name = f"member-{self.id}"
+        self.mention = f"<@{self.id}>"
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    async def add_roles(self, *roles):
+        self.roles.extend(role for role in roles if role not in self.roles)
+
+    async def remove_roles(self, *roles):
+        self.roles = [role for role in self.roles if role not in roles]
+
+
+class FakeMessage:
+    def __init__(self, channel, author=None, id=None):
+        self.id = id or snowflake()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.created_at = discord.utils.snowflake_time(self.id)
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeChannel:
+    def __init__(
+        self, guild, name, category=None, type=discord.ChannelType.text, id=None
+    ):
+        self.id = id or snowflake()
+        self.guild = guild
+        self.name = name
+        self.type = type
+        self.category = category
+        self.category_id = category.id if category else None
+        self.position = len(guild.text_channels)
+        self.mention = f"<#{self.id}>"
+        self.created_at = discord.utils.snowflake_time(self.id)
+        self.last_message_id = None
+        self.threads = []
+        self.archived = []
+        self.sent = 0
+
+    def __eq__(self, other):
+        return isinstance(other, FakeChannel) and other.id == self.id
+
+    def __hash__(self):
+        return self.id >> 22
+
+    async def fetch_message(self, id):
+        if id is None:
+            raise discord.NotFound(FakeResponse(404), {"code": 10008})
+        await asyncio.sleep(self.guild.latency)
+        return FakeMessage(self, id=id)
+
+    async def archived_threads(self, limit=100, **kwargs):
+        await asyncio.sleep(self.guild.latency)
+        for thread in self.archived[:limit]:
+            yield thread
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+        await asyncio.sleep(self.guild.latency)
+        return FakeMessage(self)
+
+    async def edit(self, **kwargs):
+        await asyncio.sleep(self.guild.latency)
+
+
+class FakeThread(FakeChannel):
+    def __init__(self, parent, id=None):
+        super().__init__(
+            parent.guild,
+            f"{parent.name}-thread",
+            type=discord.ChannelType.public_thread,
+            id=id,
+        )
+        self.parent = parent
+        self.parent_id = parent.id
+
+
+class FakeCategory:
+    def __init__(self, guild, name, id=None):
+        self.id = id or snowflake()
+        self.guild = guild
+        self.name = name
+        self.mention = f"<#{self.id}>"
+
+    @property
+    def text_channels(self):
+        return sorted(
+            (c for c in self.guild.text_channels if c.category_id == self.id),
+            key=lambda c: (c.position, c.id),
+        )
+
+    @property
+    def channels(self):
+        return self.text_channels
+
+    async def create_text_channel(self, name, overwrites=None):
+        return self.guild.add_channel(name, self)
+
+
+class FakeGuild:
+    def __init__(self, bot, name="guild", latency=0.0, id=None):
+        self.id = id or snowflake()
+        self.name = name
+        self.latency = latency
+        self.text_channels = []
+        self.channels_by_id = {}
+        self.categories = []
+        self.members_by_id = {}
+        self.roles_by_id = {}
+        self.default_role = FakeRole(self, "@everyone")
+        self.chunked = True
+        bot.http.guilds[self.id] = self
+        bot.guilds.append(self)
+
+    @property
+    def channels(self):
+        return self.categories + self.text_channels
+
+    @property
+    def members(self):
+        return list(self.members_by_id.values())
+
+    def add_category(self, name, id=None):
+        category = FakeCategory(self, name, id)
+        self.categories.append(category)
+        self.channels_by_id[category.id] = category
+        return category
+
+    def add_channel(self, name, category=None, id=None):
+        channel = FakeChannel(self, name, category, id=id)
+        self.text_channels.append(channel)
+        self.channels_by_id[channel.id] = channel
+        return channel
+
+    def add_member(self, pending=False, id=None):
+        member = FakeMember(self, pending, id)
+        self.members_by_id[member.id] = member
+        return member
+
+    def add_role(self, name):
+        role = FakeRole(self, name)
+        self.roles_by_id[role.id] = role
+        return role
+
+    def remove_channel(self, id):
+        channel = self.channels_by_id.pop(id, None)
+        if channel in self.text_channels:
+            self.text_channels.remove(channel)
+        elif channel in self.categories:
+            self.categories.remove(channel)
+        return channel
+
+    def get_channel(self, id):
+        return self.channels_by_id.get(id)
+
+    def get_member(self, id):
+        return self.members_by_id.get(id)
+
+    def get_role(self, id):
+        return self.roles_by_id.get(id)
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "fake"
+
+
+# Interaction context for slash command callbacks
+class FakeContext:
+    def __init__(self, guild, author):
+        self.guild = guild
+        self.author = author
+        self.channel = guild.text_channels[0] if guild.text_channels else None
+        self.followups = []
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_followup(self, *args, **kwargs):
+        self.followups.append(kwargs.get("embed"))
+        return FakeMessage(self.channel or FakeChannel(self.guild, "followups"))
+
+
+# Message ids spread over the last hour, newest last
+def recent_snowflakes(count):
+    now = discord.utils.utcnow()
+    return [snowflake(now - timedelta(seconds=count - i)) for i in range(count)]
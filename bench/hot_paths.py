@@ -0,0 +1,303 @@
+# Latency percentiles and database queries per event for the bot's hot paths,
+# driven offline against fake guilds
+#
+#   python -m bench.hot_paths [--guilds 5] [--spaces 200] [--messages 2000] [--rate 500]
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from loguru import logger
+
+from bench.fakes import (
+    FakeBot,
+    FakeContext,
+    FakeGuild,
+    FakeMember,
+    FakeMessage,
+    FakeThread,
+    snowflake,
+)
+from stuff import activity, attachments, db, mutations
+from stuff.pool import Pool
+from stuff.sqlite import SQLiteStorage
+from stuff.storage import MemoryStorage
+from stuff.writebehind import WriteBehind
+
+from cogs.greet import Greet
+from cogs.space import Cockpit
+
+
+# Counts statements run on every pooled connection
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
+
+    async def attach(self, pool):
+        await pool.open()
+        await pool.writer.set_trace_callback(self)
+        for _ in range(pool.size):
+            reader = await pool.readers.get()
+            await reader.set_trace_callback(self)
+            pool.readers.put_nowait(reader)
+
+
+class Scenario:
+    def __init__(self, name, counter):
+        self.name = name
+        self.counter = counter
+        self.latencies = []
+        self.queries = 0
+
+    async def run(self, event):
+        queries = self.counter.count
+        start = time.perf_counter()
+        await event
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        self.queries += self.counter.count - queries
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+        else:
+            p50 = p95 = p99 = latencies[0]
+        print(
+            f"{self.name:<32} {len(latencies):>7} {p50:>8.3f} {p95:>8.3f} "
+            f"{p99:>8.3f} {latencies[-1]:>8.3f} {self.queries / len(latencies):>9.2f}"
+        )
+
+
+def command(group, name):
+    return next(cmd for cmd in group.subcommands if cmd.name == name)
+
+
+# Fake guilds with a space category, a pinned channel, spaces with owners and
+# threads, and a few stale rows for clean-space-db to find
+async def populate(bot, args, attachment_url):
+    await db.initialize_db()
+    spaces = []
+    for n in range(args.guilds):
+        guild = FakeGuild(bot, f"guild-{n}", latency=args.latency)
+        greet_channel = guild.add_channel("welcome")
+        category = guild.add_category("spaces")
+        pinned = guild.add_channel("pinned", category)
+        for _ in range(args.members):
+            guild.add_member()
+
+        rows = []
+        members = guild.members
+        for i in range(args.spaces):
+            channel = guild.add_channel(f"space-{i}", category)
+            owner = random.choice(members)
+            channel.last_message_id = channel.id if i % 2 else None
+            thread = FakeThread(channel)
+            thread.last_message_id = thread.id
+            channel.threads.append(thread)
+            if i % 4 == 0:
+                archived = FakeThread(channel)
+                archived.last_message_id = archived.id
+                channel.archived.append(archived)
+            spaces.append((guild, channel, thread, owner))
+            rows.append((channel.id, guild.id, owner.id, True, True))
+        # Spaces whose channel or owner is gone
+        rows += [
+            (snowflake(), guild.id, random.choice(members).id, True, True)
+            for _ in range(args.spaces // 20)
+        ]
+        rows += [
+            (guild.add_channel("orphan", category).id, guild.id, snowflake(), 1, 1)
+            for _ in range(args.spaces // 20)
+        ]
+
+        await db.initialize_guild(guild)
+        await db.storage.upsert_spaces(rows)
+        guild_db = db.Guild()
+        await guild_db.async_init(guild.id)
+        await guild_db.set_category(category.id)
+        await guild_db.add_to_pinned(pinned.id)
+        await guild_db.set_greet_channel(greet_channel.id)
+        await guild_db.set_greet_message("welcome!")
+        await guild_db.add_to_greet_attachments(attachment_url)
+
+    await db.bootstrap(bot.guilds)
+    return spaces
+
+
+# Greet attachments are served from a pre-populated cache instead of the network
+def warm_attachments(directory, url):
+    content = os.urandom(64 * 1024)
+    digest = hashlib.sha256(content).hexdigest()
+    attachments.cache = attachments.AttachmentCache(
+        directory, 1024 * 1024 * 1024, 1024 * 1024 * 1024, 30.0
+    )
+    attachments.cache.urls = attachments.cache.load()
+    attachments.cache.write(digest, content)
+    attachments.cache.urls[url] = digest
+    attachments.cache.save(attachments.cache.urls)
+
+
+# Issue events at a steady rate, or back to back when rate is 0
+async def paced(events, rate):
+    start = time.perf_counter()
+    for n, event in enumerate(events):
+        if rate:
+            delay = start + n / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield event
+
+
+async def bench(args, directory):
+    random.seed(args.seed)
+    counter = QueryCounter()
+    if args.storage == "memory":
+        db.storage = MemoryStorage()
+    else:
+        db.storage = SQLiteStorage(
+            Pool(os.path.join(directory, "bench.db"), readers=args.readers)
+        )
+        await counter.attach(db.storage.pool)
+    if args.write_behind:
+        db.storage = WriteBehind(db.storage, args.write_behind, 100)
+    mutations.queue = mutations.MutationQueue(
+        {bucket: (1_000_000, 1.0) for bucket in mutations.BUCKETS}
+    )
+    url = "https://cdn.example.com/greet.mp4"
+    warm_attachments(os.path.join(directory, "greet"), url)
+
+    bot = FakeBot(args.latency)
+    spaces = await populate(bot, args, url)
+    cockpit = Cockpit(bot)
+    cockpit.bumps.window = args.bump_window
+    greet = Greet(bot)
+    scenarios = []
+
+    # Before any messages, so sort-spaces has to scan every space once
+    sort = command(Cockpit.guild_group, "sort-spaces")
+    scenario = Scenario("sort-spaces --dry-run, cold", counter)
+    scenarios.append(scenario)
+    for guild in bot.guilds:
+        ctx = FakeContext(guild, guild.members[0])
+        await scenario.run(sort.callback(cockpit, ctx, True))
+    await activity.ledger.flush()
+
+    scenario = Scenario("on_message", counter)
+    scenarios.append(scenario)
+    messages = (random.choice(spaces) for _ in range(args.messages))
+    async for guild, channel, thread, owner in paced(messages, args.rate):
+        source = thread if random.random() < args.thread_ratio else channel
+        await scenario.run(cockpit.on_message(FakeMessage(source, owner)))
+    for guild_id in list(cockpit.bumps.tasks):
+        await cockpit.bumps.flush(guild_id)
+    await activity.ledger.flush()
+
+    scenario = Scenario("on_member_update", counter)
+    scenarios.append(scenario)
+    for guild in bot.guilds:
+        for member in guild.members[: args.greets]:
+            await scenario.run(
+                greet.on_member_update(FakeMember(guild, pending=True), member)
+            )
+
+    for name, dry_run in (("sort-spaces --dry-run", True), ("sort-spaces", False)):
+        scenario = Scenario(name, counter)
+        scenarios.append(scenario)
+        for _ in range(args.repeat):
+            for guild in bot.guilds:
+                ctx = FakeContext(guild, guild.members[0])
+                await scenario.run(sort.callback(cockpit, ctx, dry_run))
+
+    clean = command(Cockpit.guild_group, "clean-space-db")
+    scenario = Scenario("clean-space-db", counter)
+    scenarios.append(scenario)
+    for _ in range(args.repeat):
+        for guild in bot.guilds:
+            ctx = FakeContext(guild, guild.members[0])
+            await scenario.run(clean.callback(cockpit, ctx, False))
+
+    lookups = {
+        "Guild.async_init": lambda guild, channel, owner: db.Guild().async_init(
+            guild.id
+        ),
+        "Space.async_init": lambda guild, channel, owner: db.Space().async_init(
+            channel.id, guild.id
+        ),
+        "Owner.async_init": lambda guild, channel, owner: db.Owner().async_init(
+            guild.id, owner.id
+        ),
+        "Owner.async_count": lambda guild, channel, owner: db.Owner().async_count(
+            guild.id, owner.id
+        ),
+    }
+    sample = random.sample(spaces, min(args.lookups, len(spaces)))
+    for name, lookup in lookups.items():
+        scenario = Scenario(name, counter)
+        scenarios.append(scenario)
+        for guild, channel, thread, owner in sample:
+            await scenario.run(lookup(guild, channel, owner))
+
+    scenario = Scenario("Space.set_bump", counter)
+    scenarios.append(scenario)
+    for guild, channel, thread, owner in sample:
+        space_db = db.Space()
+        await space_db.async_init(channel.id, guild.id)
+        await scenario.run(space_db.set_bump(not space_db.bump_on_message))
+
+    # Let queued reorders and greetings finish before reporting
+    await asyncio.gather(*mutations.queue.workers.values())
+    return scenarios, bot
+
+
+async def main(args):
+    logger.remove()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            scenarios, bot = await bench(args, directory)
+        finally:
+            await db.storage.close()
+
+    print(
+        f"{args.guilds} guilds, {args.spaces} spaces per guild, "
+        f"{args.messages} messages at {args.rate or 'max'}/s, {args.storage} storage"
+    )
+    print(
+        f"{'event':<32} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'max ms':>8} {'queries':>9}"
+    )
+    for scenario in scenarios:
+        scenario.report()
+    stats = mutations.queue.stats()
+    print(
+        f"bulk position updates: {bot.http.calls}, "
+        f"mutations executed: {stats['executed']}, merged: {stats['merged']}, "
+        f"failed: {stats['failed']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--spaces", type=int, default=200, help="spaces per guild")
+    parser.add_argument("--members", type=int, default=100, help="members per guild")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500, help="messages per second")
+    parser.add_argument("--thread-ratio", type=float, default=0.2)
+    parser.add_argument("--greets", type=int, default=20, help="greets per guild")
+    parser.add_argument("--repeat", type=int, default=3, help="command runs per guild")
+    parser.add_argument("--lookups", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency")
+    parser.add_argument("--bump-window", type=float, default=0.1)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite")
+    parser.add_argument("--write-behind", type=float, default=0.0, help="seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
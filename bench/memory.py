@@ -0,0 +1,230 @@
+# Resident gateway state in the default and low-memory modes, after replaying
+# the same synthetic gateway member events, the size of the benchmark
+# fixtures, through pycord's ConnectionState with each mode's client options
+#
+#   python -m bench.memory [--guilds 5] [--members 20000] [--spaces 200]
+import argparse
+import asyncio
+import gc
+import random
+import tracemalloc
+
+import discord
+from discord.state import ConnectionState
+
+from bench.fakes import snowflake
+from stuff import members
+
+SELF_ID = snowflake()
+# Members per GUILD_MEMBERS_CHUNK event, and seconds before it arrives
+CHUNK_SIZE = 1000
+LATENCY = 0.001
+
+
+def user(id):
+    return {
+        "id": str(id),
+        "username": f"user{id % 100000}",
+        "global_name": f"User {id % 100000}",
+        "discriminator": "0",
+        "avatar": "0" * 32,
+    }
+
+
+def member(id, roles, pending=False):
+    return {
+        "user": user(id),
+        "roles": roles,
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "pending": pending,
+        "flags": 0,
+    }
+
+
+def presence(id):
+    return {
+        "user": {"id": str(id)},
+        "status": "online",
+        "client_status": {"desktop": "online"},
+        "activities": [
+            {
+                "name": "Some Game",
+                "type": 0,
+                "created_at": 1700000000000,
+                "details": "In a match",
+                "state": "Ranked",
+            }
+        ],
+    }
+
+
+def channel(id, name, type, position, parent_id=None):
+    return {
+        "id": str(id),
+        "type": type,
+        "name": name,
+        "position": position,
+        "parent_id": str(parent_id) if parent_id else None,
+        "permission_overwrites": [],
+    }
+
+
+# One guild as the gateway knows it: the GUILD_CREATE fields, every member
+# and presence, the space owners and the members who will join
+def guild_payload(args):
+    guild_id = snowflake()
+    roles = [
+        {
+            "id": str(snowflake()),
+            "name": f"role-{i}",
+            "permissions": "0",
+            "position": i,
+            "color": 0,
+            "hoist": False,
+            "managed": False,
+            "mentionable": False,
+        }
+        for i in range(20)
+    ]
+    role_ids = [role["id"] for role in roles]
+    category_id = snowflake()
+    channels = [channel(category_id, "spaces", 4, 0)] + [
+        channel(snowflake(), f"space-{i}", 0, i, category_id)
+        for i in range(args.spaces)
+    ]
+    member_ids = [snowflake() for _ in range(args.members)]
+    roster = {
+        id: member(id, random.sample(role_ids, 3)) for id in member_ids + [SELF_ID]
+    }
+    presences = {id: presence(id) for id in member_ids if random.random() < args.online}
+    guild = {
+        "id": str(guild_id),
+        "name": "guild",
+        "owner_id": str(member_ids[0]),
+        "roles": roles,
+        "channels": channels,
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "member_count": len(roster),
+        "large": True,
+    }
+    owners = random.sample(member_ids, min(args.spaces, len(member_ids)))
+    joiners = [snowflake() for _ in range(int(len(member_ids) * args.joiners))]
+    return guild, roster, presences, owners, joiners
+
+
+# Answers member requests with GUILD_MEMBERS_CHUNK events from the rosters,
+# a moment after the request returns as the real gateway does
+class Gateway:
+    def __init__(self, state, payloads):
+        self.state = state
+        self.guilds = {
+            int(guild["id"]): (roster, presences)
+            for guild, roster, presences, *_ in payloads
+        }
+
+    async def request_chunks(
+        self, guild_id, query=None, *, limit, user_ids=None, presences=False, nonce=None
+    ):
+        roster, online = self.guilds[guild_id]
+        ids = [id for id in user_ids if id in roster] if user_ids else list(roster)
+        # An empty answer is still one chunk
+        chunks = [ids[i : i + CHUNK_SIZE] for i in range(0, len(ids), CHUNK_SIZE)] or [
+            []
+        ]
+        for index, chunk in enumerate(chunks):
+            data = {
+                "guild_id": str(guild_id),
+                "members": [roster[id] for id in chunk],
+                "chunk_index": index,
+                "chunk_count": len(chunks),
+                "nonce": nonce,
+            }
+            if presences:
+                data["presences"] = [online[id] for id in chunk if id in online]
+            self.state.loop.call_later(
+                LATENCY, self.state.parse_guild_members_chunk, data
+            )
+
+
+# Replay a session's member events against the client options: GUILD_CREATE,
+# the startup chunking the options ask for, cache_owners' owner lookup and
+# GUILD_MEMBER_ADD for each joiner
+async def build(payloads, low_memory):
+    options = members.client_options(low_memory)
+    state = ConnectionState(
+        dispatch=lambda *args: None,
+        handlers={},
+        hooks={},
+        http=None,
+        loop=asyncio.get_running_loop(),
+        **options,
+    )
+    state.user = discord.ClientUser(state=state, data=user(SELF_ID))
+    gateway = Gateway(state, payloads)
+    state._get_websocket = lambda guild_id=None, shard_id=None: gateway
+    intents = options["intents"]
+
+    for guild, roster, presences, owners, joiners in payloads:
+        # A large guild arrives with the bot and, when presences are on, the
+        # online members and their presences
+        online = presences if intents.presences else {}
+        state.parse_guild_create(
+            {
+                **guild,
+                "members": [roster[SELF_ID]] + [roster[id] for id in online],
+                "presences": list(online.values()),
+            }
+        )
+    # Let startup chunking finish
+    while state._chunk_guilds and not all(guild.chunked for guild in state.guilds):
+        await asyncio.sleep(LATENCY)
+
+    guilds = []
+    for guild, roster, presences, owners, joiners in payloads:
+        guild = state._get_guild(int(guild["id"]))
+        await members.resolve(guild, owners)
+        for id in joiners:
+            state.parse_guild_member_add(
+                {**member(id, [], pending=True), "guild_id": str(guild.id)}
+            )
+        guilds.append(guild)
+    return state, guilds
+
+
+async def measure(payloads, low_memory):
+    gc.collect()
+    tracemalloc.start()
+    state, guilds = await build(payloads, low_memory)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cached = sum(len(guild.members) for guild in guilds)
+    return size, cached, len(state._users)
+
+
+async def main(args):
+    random.seed(args.seed)
+    payloads = [guild_payload(args) for _ in range(args.guilds)]
+    print(
+        f"{args.guilds} guilds, {args.members} members and {args.spaces} spaces "
+        f"per guild, {args.online:.0%} online"
+    )
+    print(f"{'mode':<12} {'MiB':>10} {'members':>10} {'users':>10}")
+    for name, low_memory in (("default", False), ("low-memory", True)):
+        size, cached, users = await measure(payloads, low_memory)
+        print(f"{name:<12} {size / 1024 / 1024:>10.1f} {cached:>10} {users:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=5)
+    parser.add_argument("--members", type=int, default=20000, help="per guild")
+    parser.add_argument("--spaces", type=int, default=200, help="per guild")
+    parser.add_argument("--online", type=float, default=0.3, help="online share")
+    parser.add_argument("--joiners", type=float, default=0.01, help="pending share")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
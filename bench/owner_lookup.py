@@ -0,0 +1,72 @@
+# Owner lookup and max-spaces check timings before and after the spaces indexes
+#
+#   python -m bench.owner_lookup [--spaces 100000] [--lookups 200]
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from stuff import db, sqlite
+from stuff.pool import Pool
+from stuff.sqlite import SQLiteStorage
+
+
+async def populate(path, spaces, guilds):
+    db.storage = SQLiteStorage(Pool(path, readers=1))
+    async with db.storage.pool.write() as conn:
+        await conn.execute("BEGIN")
+        # Stop before the index migration so there is a "before" to measure
+        migrations = sqlite.MIGRATIONS[: sqlite.MIGRATIONS.index(sqlite.index_spaces)]
+        for version, migration in enumerate(migrations, 1):
+            await migration(conn)
+            await conn.execute(f"PRAGMA user_version = {version}")
+        await conn.executemany(
+            "INSERT INTO spaces VALUES (?, ?, ?, 1, 1)",
+            (
+                (space_id, space_id % guilds, random.randrange(spaces // 2))
+                for space_id in range(spaces)
+            ),
+        )
+
+
+async def measure(lookups, spaces, guilds):
+    owners = [
+        (random.randrange(guilds), random.randrange(spaces // 2))
+        for _ in range(lookups)
+    ]
+    timings = {}
+    for name, method in (
+        ("Owner.async_init", db.Owner.async_init),
+        ("Owner.async_count", db.Owner.async_count),
+    ):
+        start = time.perf_counter()
+        for guild_id, owner_id in owners:
+            await method(db.Owner(), guild_id, owner_id)
+        timings[name] = (time.perf_counter() - start) / lookups * 1000
+    return timings
+
+
+async def main(args):
+    print(f"{'spaces':>8} {'query':<18} {'before ms':>10} {'after ms':>10}")
+    for spaces in args.scales or [args.spaces // 100, args.spaces // 10, args.spaces]:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bench.db")
+            await populate(path, spaces, args.guilds)
+            before = await measure(args.lookups, spaces, args.guilds)
+            await db.initialize_db()
+            after = await measure(args.lookups, spaces, args.guilds)
+            await db.storage.close()
+
+        for name in before:
+            print(f"{spaces:>8} {name:<18} {before[name]:>10.3f} {after[name]:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spaces", type=int, default=100_000)
+    parser.add_argument("--scales", type=int, nargs="*")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--lookups", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,97 @@
+# Resident memory of 1M spaces in each record layout: the old dict-backed and
+# dict-of-fields shapes, the slotted Space, SpaceRow and the space index
+#
+#   python -m bench.records [--spaces 1000000] [--guilds 100] [--owners 100000]
+import argparse
+import gc
+import random
+import tracemalloc
+
+from bench.fakes import snowflake
+from stuff import cache, db
+from stuff.storage import SPACE_FIELDS, SpaceRow
+
+
+# Space as it was before __slots__
+class DictSpace:
+    def __init__(self, row):
+        self.space_id = row[0]
+        self.guild_id = row[1]
+        self.owner_id = row[2]
+        self.bump_on_message = row[3]
+        self.bump_on_thread_message = row[4]
+        self.exists = True
+
+
+def dict_spaces(rows):
+    return [DictSpace(row) for row in rows]
+
+
+# Owner.spaces entries as they were, one dict per space
+def dict_rows(rows):
+    return [dict(zip(SPACE_FIELDS, row)) for row in rows]
+
+
+def slotted_spaces(rows):
+    spaces = []
+    for row in rows:
+        space = db.Space()
+        space.load(row)
+        spaces.append(space)
+    return spaces
+
+
+def space_rows(rows):
+    return [SpaceRow._make(row) for row in rows]
+
+
+def space_index(rows):
+    index = cache.SpaceIndex()
+    index.load(rows)
+    return index
+
+
+LAYOUTS = {
+    "Space with __dict__": dict_spaces,
+    "dict per space": dict_rows,
+    "Space with __slots__": slotted_spaces,
+    "SpaceRow": space_rows,
+    "space index": space_index,
+}
+
+
+# Only what the layout adds on top of the ids, which every layout shares
+def measure(build, rows):
+    gc.collect()
+    tracemalloc.start()
+    records = build(rows)
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def main(args):
+    random.seed(args.seed)
+    guild_ids = [snowflake() for _ in range(args.guilds)]
+    owner_ids = [snowflake() for _ in range(args.owners)]
+    rows = [
+        SpaceRow(snowflake(), random.choice(guild_ids), random.choice(owner_ids), 1, 1)
+        for _ in range(args.spaces)
+    ]
+
+    print(f"{args.spaces} spaces in {args.guilds} guilds, {args.owners} owners")
+    print(f"{'layout':<22} {'MiB':>10} {'bytes/space':>12}")
+    for name, build in LAYOUTS.items():
+        size = measure(build, rows)
+        print(f"{name:<22} {size / 1024 / 1024:>10.1f} {size / args.spaces:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spaces", type=int, default=1_000_000)
+    parser.add_argument("--guilds", type=int, default=100)
+    parser.add_argument("--owners", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,203 @@
+# Replay a gateway recording through the cogs against a scratch database
+#
+#   python -m bench.replay recording.jsonl.gz [--speed 1] [--latency 0.05]
+#
+# --speed 1 replays at the recorded pace, 10 ten times faster, 0 as fast as
+# possible. Budgets default to the production ones so bump storms queue up the
+# same way; --unlimited removes them.
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from loguru import logger
+
+from bench.fakes import FakeBot, FakeGuild, FakeMember, FakeMessage, FakeThread
+from bench.hot_paths import QueryCounter, Scenario, warm_attachments
+from stuff import activity, db, hygiene, mutations, recorder
+from stuff.pool import Pool
+from stuff.sqlite import SQLiteStorage
+
+from cogs.greet import Greet
+from cogs.space import Cockpit
+
+GREET_URL = "https://cdn.example.com/greet-{}.mp4"
+
+
+# Fake guilds rebuilt from snapshots, growing as unseen ids show up
+class World:
+    def __init__(self, bot, latency, directory):
+        self.bot = bot
+        self.latency = latency
+        self.directory = directory
+
+    def guild(self, guild_id):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            guild = FakeGuild(self.bot, str(guild_id), self.latency, guild_id)
+        return guild
+
+    def channel(self, guild, channel_id, parent_id=None):
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            if parent_id is not None:
+                channel = FakeThread(self.channel(guild, parent_id), channel_id)
+                channel.parent.threads.append(channel)
+            else:
+                channel = guild.add_channel(str(channel_id), id=channel_id)
+        return channel
+
+    def member(self, guild, member_id):
+        return guild.get_member(member_id) or guild.add_member(id=member_id)
+
+    async def restore(self, record):
+        guild = self.guild(record["guild_id"])
+        for category_id in record["categories"]:
+            if guild.get_channel(category_id) is None:
+                guild.add_category(str(category_id), category_id)
+        for channel_id, category_id, position in record["channels"]:
+            channel = guild.get_channel(channel_id) or guild.add_channel(
+                str(channel_id), guild.get_channel(category_id), channel_id
+            )
+            channel.position = position
+
+        await db.initialize_guild(guild)
+        await db.storage.upsert_spaces(
+            [(space_id, guild.id, *entry) for space_id, *entry in record["spaces"]]
+        )
+        guild_db = db.Guild()
+        await guild_db.async_init(guild.id)
+        if record["space_category_id"]:
+            await guild_db.set_category(record["space_category_id"])
+        for channel_id in record["pinned_channel_ids"]:
+            await guild_db.add_to_pinned(channel_id)
+        if record["greet_channel_id"]:
+            await guild_db.set_greet_channel(record["greet_channel_id"])
+        for n in range(record["greet_attachments"]):
+            url = GREET_URL.format(n)
+            warm_attachments(self.directory, url)
+            await guild_db.add_to_greet_attachments(url)
+
+    # Build the listener arguments for an event
+    def arguments(self, record):
+        guild = self.guild(record["guild_id"])
+        event = record["event"]
+        if event == "message":
+            channel = self.channel(guild, record["channel_id"], record["parent_id"])
+            author = self.member(guild, record["author_id"])
+            return "on_message", (FakeMessage(channel, author, record["message_id"]),)
+        if event == "member_update":
+            after = self.member(guild, record["member_id"])
+            after.pending = record["after_pending"]
+            before = FakeMember(guild, record["before_pending"], after.id)
+            return "on_member_update", (before, after)
+        if event == "channel_create":
+            if record["category"]:
+                channel = guild.add_category(
+                    str(record["channel_id"]), record["channel_id"]
+                )
+            else:
+                channel = guild.add_channel(
+                    str(record["channel_id"]),
+                    guild.get_channel(record["category_id"]),
+                    record["channel_id"],
+                )
+                channel.position = record["position"]
+            return "on_guild_channel_create", (channel,)
+        if event == "channel_delete":
+            channel = guild.remove_channel(record["channel_id"])
+            if channel is None:
+                return None
+            return "on_guild_channel_delete", (channel,)
+
+
+async def replay(args, directory):
+    db.storage = SQLiteStorage(
+        Pool(os.path.join(directory, "replay.db"), readers=args.readers)
+    )
+    counter = QueryCounter()
+    await counter.attach(db.storage.pool)
+    await db.initialize_db()
+    if args.unlimited:
+        mutations.queue = mutations.MutationQueue(
+            {bucket: (1_000_000, 1.0) for bucket in mutations.BUCKETS}
+        )
+    bot = FakeBot(args.latency)
+    world = World(bot, args.latency, os.path.join(directory, "greet"))
+    cogs = [Cockpit(bot), Greet(bot)]
+    listeners = {}
+    for cog in cogs:
+        for name, method in cog.get_listeners():
+            listeners.setdefault(name, []).append(method)
+
+    scenarios = {}
+    records = recorder.read(args.recording)
+    restored = False
+    start = first = None
+    for record in records:
+        if record["event"] == "snapshot":
+            await world.restore(record)
+            continue
+        if not restored:
+            await db.bootstrap(bot.guilds)
+            restored = True
+
+        if first is None:
+            start, first = time.perf_counter(), record["time"]
+        if args.speed:
+            delay = (record["time"] - first) / args.speed - (
+                time.perf_counter() - start
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        dispatch = world.arguments(record)
+        if dispatch is None:
+            continue
+        name, arguments = dispatch
+        for listener in listeners.get(name, ()):
+            scenario = scenarios.get(listener.__qualname__)
+            if scenario is None:
+                scenario = scenarios[listener.__qualname__] = Scenario(
+                    listener.__qualname__, counter
+                )
+            await scenario.run(listener(*arguments))
+
+    elapsed = time.perf_counter() - start if start is not None else 0.0
+    for guild_id in list(cogs[0].bumps.tasks):
+        await cogs[0].bumps.flush(guild_id)
+    await activity.ledger.flush()
+    await hygiene.hygiene.flush()
+    await asyncio.gather(*mutations.queue.workers.values())
+    return scenarios.values(), bot, cogs[0], elapsed
+
+
+async def main(args):
+    logger.remove()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            scenarios, bot, cockpit, elapsed = await replay(args, directory)
+        finally:
+            await db.storage.close()
+
+    print(f"Replayed {args.recording} in {elapsed:.2f}s")
+    print(
+        f"{'listener':<32} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} "
+        f"{'p99 ms':>8} {'max ms':>8} {'queries':>9}"
+    )
+    for scenario in scenarios:
+        scenario.report()
+    print(f"bumps: {cockpit.bumps.stats()}")
+    print(f"bulk position updates: {bot.http.calls}")
+    print(f"mutations: {mutations.queue.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency")
+    parser.add_argument("--unlimited", action="store_true")
+    parser.add_argument("--readers", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
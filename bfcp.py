@@ -3,10 +3,29 @@ import os
 import sys
 
 import discord
-from environs import Env
 from loguru import logger
 
-from stuff import db
+from stuff import attachments, cache, db, hygiene, members, metrics, mutations
+from stuff.activity import ledger
+from stuff.config import (
+    DB_BUSY_TIMEOUT,
+    DB_PROFILE,
+    DB_READERS,
+    GATEWAY_RECORD_PATH,
+    LOW_MEMORY,
+    METRICS_HOST,
+    METRICS_PORT,
+    SHARD_COUNT,
+    SHARD_IDS,
+    SHARDED,
+    WRITE_BEHIND_INTERVAL,
+    WRITE_BEHIND_MAX_OPERATIONS,
+    env,
+)
+from stuff.pool import Pool
+from stuff.recorder import GatewayRecorder
+from stuff.sqlite import SQLiteStorage
+from stuff.writebehind import WriteBehind
 
 
 class InterceptHandler(logging.Handler):
@@ -40,30 +59,116 @@ logger.add(
 if not os.path.exists("data"):
     os.makedirs("data")
 
+# Database
+db.storage = SQLiteStorage(
+    Pool(
+        "data/database.db",
+        readers=DB_READERS,
+        busy_timeout=DB_BUSY_TIMEOUT,
+        profile=DB_PROFILE,
+    )
+)
+if WRITE_BEHIND_INTERVAL:
+    db.storage = WriteBehind(
+        db.storage, WRITE_BEHIND_INTERVAL, WRITE_BEHIND_MAX_OPERATIONS
+    )
+
+
+class BotMixin:
+    # Serve metrics before connecting, so startup is measured too
+    async def start(self, *args, **kwargs):
+        if METRICS_PORT:
+            await metrics.registry.start(METRICS_HOST, METRICS_PORT)
+        await super().start(*args, **kwargs)
+
+    async def invoke_application_command(self, ctx):
+        with metrics.registry.timer(
+            "bfcp_command_seconds", command=ctx.command.qualified_name
+        ):
+            await super().invoke_application_command(ctx)
+
+    async def close(self):
+        await super().close()
+        await metrics.registry.stop()
+        mutations.queue.cancel()
+        await ledger.flush()
+        await hygiene.hygiene.flush()
+        await attachments.cache.close()
+        await db.storage.close()
+        if recorder:
+            recorder.close()
+
+
+class Bot(BotMixin, discord.Bot):
+    pass
+
+
+class ShardedBot(BotMixin, discord.AutoShardedBot):
+    pass
+
+
 # Activity status
 activity = discord.Activity(name="in the cockpit", type=discord.ActivityType.playing)
-intents = discord.Intents.all()
-bot = discord.Bot(activity=activity, intents=intents)
+# Sharding: SHARDED runs every shard in this process, and SHARD_COUNT with
+# SHARD_IDS runs one shard group so the others can live in other processes
+if SHARDED or SHARD_IDS:
+    bot = ShardedBot(
+        activity=activity,
+        shard_count=SHARD_COUNT or None,
+        shard_ids=SHARD_IDS or None,
+        **members.client_options(LOW_MEMORY),
+    )
+else:
+    bot = Bot(activity=activity, **members.client_options(LOW_MEMORY))
 
 bot.load_extension("cogs")
 
-# Environmental variables
-env = Env()
-env.read_env()
+# Gateway recording for offline replay, off unless a path is configured
+recorder = None
+if GATEWAY_RECORD_PATH:
+    recorder = GatewayRecorder(GATEWAY_RECORD_PATH)
+    recorder.attach(bot)
+
+# Metrics endpoint, off unless a port is configured
+if METRICS_PORT:
+    metrics.register_defaults(bot)
+
+
+# Initialize a shard's slice of the database and caches on its first ready,
+# then only register its guilds that appeared while it was disconnected
+async def prepare_shard(shard_id):
+    cache.shard_count = bot.shard_count or 1
+    guilds = [guild for guild in bot.guilds if guild.shard_id == shard_id]
+    if shard_id not in cache.spaces.loaded:
+        await db.bootstrap(guilds, [shard_id])
+        if recorder:
+            recorder.snapshot(guilds)
+        if LOW_MEMORY:
+            await members.cache_owners(guilds)
+    else:
+        missing = [guild for guild in guilds if guild.id not in cache.guilds]
+        if missing:
+            await db.initialize_guilds(missing)
 
 
 @bot.event
+@metrics.listener
 async def on_ready():
     logger.info(f"Logged in as {bot.user}")
+    if not isinstance(bot, discord.AutoShardedBot):
+        await prepare_shard(0)
+
 
-    # Initialize database
-    await db.initialize_db()
-    for guild in bot.guilds:
-        await db.initialize_guild(guild)
+@bot.event
+@metrics.listener
+async def on_shard_ready(shard_id):
+    logger.info(f"Shard {shard_id} is ready.")
+    await prepare_shard(shard_id)
 
 
 # Add new guilds
 @bot.event
+@metrics.listener
 async def on_guild_join(guild):
     await db.initialize_guild(guild)
 
@@ -1,20 +1,25 @@
+import asyncio
 import random
 from io import BytesIO
 
 import discord
-import requests
 from discord.ext import commands
+from loguru import logger
 
-from stuff.db import autocomplete_greet_attachment, Guild
+from stuff import attachments, autocomplete, metrics, mutations
+from stuff.db import Guild
 
 
 class Greet(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # Background cache warm-ups, kept so they aren't collected mid-run
+        self.tasks = set()
 
     greet_group = discord.SlashCommandGroup("greet", "Commands related to greeting")
 
     @commands.Cog.listener()
+    @metrics.listener
     async def on_member_update(self, before, after):
         guild_db = Guild()
         await guild_db.async_init(after.guild.id)
@@ -26,16 +31,25 @@ class Greet(commands.Cog):
         if before.pending and not after.pending:
             greet_channel = after.guild.get_channel(guild_db.greet_channel_id)
             if greet_channel:
-                greet_attachment = requests.get(
-                    random.choice(guild_db.greet_attachments)
-                )
-
-                await greet_channel.send(
-                    f"{guild_db.greet_message}",
-                    file=discord.File(
-                        BytesIO(greet_attachment.content), filename="greetings.mp4"
-                    ),
-                    allowed_mentions=discord.AllowedMentions.all(),
+                url = random.choice(guild_db.greet_attachments)
+                try:
+                    greet_attachment = await attachments.cache.get(url)
+                except attachments.ERRORS as e:
+                    logger.warning(f"Failed to fetch greet attachment {url}: {e!r}")
+                    return
+
+                # Build the file per attempt, since sending consumes it
+                async def greet():
+                    await greet_channel.send(
+                        f"{guild_db.greet_message}",
+                        file=discord.File(
+                            BytesIO(greet_attachment), filename="greetings.mp4"
+                        ),
+                        allowed_mentions=discord.AllowedMentions.all(),
+                    )
+
+                await mutations.queue.submit(
+                    after.guild.id, None, greet, mutations.BACKGROUND, "messages"
                 )
 
     # Set greet channel
@@ -52,7 +66,7 @@ class Greet(commands.Cog):
         guild_db = Guild()
         await guild_db.async_init(ctx.guild.id)
         if await guild_db.check_exists(ctx):
-            guild_db.set_greet_channel(channel.id)
+            await guild_db.set_greet_channel(channel.id)
             await ctx.send_followup(
                 embed=discord.Embed(
                     description=f"Greetings channel set to {channel.mention}.",
@@ -72,7 +86,7 @@ class Greet(commands.Cog):
         guild_db = Guild()
         await guild_db.async_init(ctx.guild.id)
         if await guild_db.check_exists(ctx):
-            guild_db.set_greet_message(message)
+            await guild_db.set_greet_message(message)
             await ctx.send_followup(
                 embed=discord.Embed(
                     description="Greetings message set.",
@@ -96,6 +110,9 @@ class Greet(commands.Cog):
         await guild_db.async_init(ctx.guild.id)
         if await guild_db.check_exists(ctx):
             await guild_db.add_to_greet_attachments(url)
+            task = asyncio.create_task(attachments.cache.warm(url))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
             await ctx.send_followup(
                 embed=discord.Embed(
                     description=f"Greetings [attachment]({url}) added.",
@@ -114,7 +131,7 @@ class Greet(commands.Cog):
         url: discord.Option(
             str,
             "The greet attachment URL to remove",
-            autocomplete=autocomplete_greet_attachment,
+            autocomplete=autocomplete.greet_attachments,
         ),
     ):
         await ctx.defer()
@@ -125,6 +142,7 @@ class Greet(commands.Cog):
             ctx, url
         ):
             await guild_db.remove_from_greet_attachments(url)
+            await attachments.cache.purge(url)
             await ctx.send_followup(
                 embed=discord.Embed(
                     description=f"Greetings [attachment]({url}) removed.",
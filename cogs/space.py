@@ -1,13 +1,58 @@
-import aiosqlite
+import asyncio
+import functools
+from datetime import datetime, timedelta, timezone
+
 import discord
 from discord.ext import commands
-
+from loguru import logger
+
+from stuff import activity, autocomplete, cache, db, members, metrics, mutations
+from stuff.hygiene import hygiene
+from stuff.bump import BumpScheduler, add_bump
+from stuff.config import BUMP_WINDOW, THREAD_SCAN_CONCURRENCY
+from stuff.reorder import plan_moves
+from stuff.roles import RolePropagation
 from stuff.db import Guild, Owner, Space
 
+# Interaction tokens last 15 minutes; stop using them a little early
+TOKEN_LIFETIME = timedelta(minutes=14)
+# Discord's error code for a followup sent with an expired token
+INVALID_WEBHOOK_TOKEN = 50027
+
 
 class Cockpit(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.bumps = BumpScheduler(BUMP_WINDOW, self.apply_bumps)
+        # Bumps waiting for their category's queued reorder, by category id
+        self.pending_bumps = {}
+        metrics.registry.gauge(
+            "bfcp_bumps_total",
+            "Space bumps by outcome",
+            lambda: [({"state": k}, v) for k, v in self.bumps.stats().items()],
+            type="counter",
+        )
+
+    def cog_unload(self):
+        self.bumps.cancel()
+        self.flush_task = asyncio.create_task(self.flush_writes())
+        self.flush_task.add_done_callback(self.flushed_writes)
+
+    # Write out the buffers that feed storage, then storage's own
+    async def flush_writes(self):
+        await activity.ledger.flush()
+        await hygiene.flush()
+        await db.storage.flush()
+
+    def flushed_writes(self, task):
+        if task.cancelled():
+            logger.warning("Flushing pending writes on unload was cancelled.")
+        elif task.exception() is not None:
+            logger.opt(exception=task.exception()).error(
+                "Failed to flush pending writes on unload."
+            )
+        else:
+            logger.info("Flushed pending writes on unload.")
 
     guild_group = discord.SlashCommandGroup("guild", "Commands to configure the guild")
 
@@ -43,8 +88,135 @@ class Cockpit(commands.Cog):
             )
         return overwrites
 
+    # Positions payload that applies a target ordering of a category's channels
+    def positions(category, ordered_channels):
+        ordered_ids = {channel.id for channel in ordered_channels}
+        ordered = iter(ordered_channels)
+        current = sorted(
+            category.channels, key=lambda channel: (channel.position, channel.id)
+        )
+        # Splice the new order into the position slots the category's channels
+        # already hold, leaving other channels and categories alone
+        channels = [
+            next(ordered) if channel.id in ordered_ids else channel
+            for channel in current
+        ]
+        slots = []
+        for channel in current:
+            # Spread out tied positions so the order can take effect
+            slots.append(max(channel.position, slots[-1] + 1 if slots else 0))
+        return [
+            {"id": channel.id, "position": position}
+            for position, channel in zip(slots, channels)
+            if channel.position != position
+        ]
+
+    # Apply a target ordering of a category's channels with one bulk request
+    async def reorder(self, category, ordered_channels):
+        payload = Cockpit.positions(category, ordered_channels)
+        if payload:
+            await self.bot.http.bulk_channel_update(category.guild.id, payload)
+        return len(payload)
+
+    # Move bumped spaces to their targets, one queued reorder per category
+    async def apply_bumps(self, guild_id, bumps):
+        categories = {}
+        for channel, position in bumps:
+            if channel.category is None:
+                continue
+            categories[channel.category] = channel.category
+            add_bump(
+                self.pending_bumps.setdefault(channel.category.id, {}),
+                channel,
+                position,
+            )
+
+        requests = 0
+        for category in categories.values():
+            if await mutations.queue.submit(
+                category.guild.id,
+                ("bump", category.id),
+                functools.partial(self.reorder_bumps, category),
+                mutations.BACKGROUND,
+                "positions",
+            ):
+                requests += 1
+        return requests
+
+    # Apply a category's pending bumps to its channels as they are when the job
+    # runs, so a sort or move that finished while it waited is kept
+    async def reorder_bumps(self, category):
+        bumps = self.pending_bumps.pop(category.id, {})
+        channels = sorted(
+            category.text_channels, key=lambda channel: (channel.position, channel.id)
+        )
+        for channel, position in bumps.values():
+            if channel not in channels:
+                continue
+            channels.remove(channel)
+            index = next(
+                (i for i, other in enumerate(channels) if other.position >= position),
+                len(channels),
+            )
+            channels.insert(index, channel)
+        return await self.reorder(category, channels)
+
+    # Members who own at least one space in the guild
+    async def owners(self, guild):
+        owner_ids = await db.get_owner_ids(guild.id)
+        return list((await members.resolve(guild, owner_ids)).values())
+
+    # Whether the interaction token, which followups and their edits use, has
+    # expired or is about to
+    def token_expired(ctx):
+        return discord.utils.utcnow() - ctx.interaction.created_at > TOKEN_LIFETIME
+
+    # Send a followup, or a channel message once the token has expired, as it
+    # can during a long role propagation
+    async def followup(ctx, embed):
+        if not Cockpit.token_expired(ctx):
+            try:
+                return await ctx.send_followup(embed=embed)
+            except discord.HTTPException as e:
+                if e.code != INVALID_WEBHOOK_TOKEN:
+                    raise
+        return await ctx.channel.send(embed=embed)
+
+    # Apply role changes to owners, reporting progress and returning a summary
+    async def propagate_roles(self, ctx, changes):
+        if not changes:
+            return "No owners needed updating."
+
+        message = await Cockpit.followup(
+            ctx,
+            discord.Embed(description=f"Updating roles for {len(changes)} owners…"),
+        )
+        followup = not Cockpit.token_expired(ctx)
+
+        async def progress(propagation):
+            nonlocal message, followup
+            embed = discord.Embed(
+                description=f"Updated roles for {propagation.done}/{propagation.total} owners…"
+            )
+            if followup and Cockpit.token_expired(ctx):
+                # The followup can't be edited any more, so continue in the channel
+                message = await ctx.channel.send(embed=embed)
+                followup = False
+            else:
+                await message.edit(embed=embed)
+
+        propagation = await RolePropagation(progress=progress).run(changes)
+        summary = f"Updated **{propagation.changed}** of {propagation.total} owners."
+        if propagation.failed:
+            failed = ", ".join(member.mention for member, _ in propagation.failed[:10])
+            if len(propagation.failed) > 10:
+                failed += f" and {len(propagation.failed) - 10} more"
+            summary += f"\nFailed for **{len(propagation.failed)}**: {failed}"
+        return summary
+
     # Bump spaces
     @commands.Cog.listener()
+    @metrics.listener
     async def on_message(self, message):
         channel = message.channel
 
@@ -54,21 +226,26 @@ class Cockpit(commands.Cog):
         ):
             return
 
-        space_db = Space()
+        # Threads bump their parent space
         if channel.type == discord.ChannelType.public_thread:
-            await space_db.async_init(channel.id, channel.parent.guild.id)
+            space_id = channel.parent_id
         else:
-            await space_db.async_init(channel.id, channel.guild.id)
+            space_id = channel.id
+
+        space_db = Space()
+        if not space_db.from_index(space_id, channel.guild.id):
+            await space_db.async_init(space_id, channel.guild.id)
+        if not space_db.exists:
+            return
+
+        activity.ledger.record(
+            channel.guild.id, space_id, message.created_at.timestamp()
+        )
         if (
-            not space_db.exists
-            or (
-                channel.type == discord.ChannelType.public_thread
-                and not space_db.bump_on_thread_message
-            )
-            or (
-                channel.type == discord.ChannelType.text
-                and not space_db.bump_on_message
-            )
+            channel.type == discord.ChannelType.public_thread
+            and not space_db.bump_on_thread_message
+        ) or (
+            channel.type == discord.ChannelType.text and not space_db.bump_on_message
         ):
             return
 
@@ -88,7 +265,48 @@ class Cockpit(commands.Cog):
                 if pinned_channel and pinned_channel.category_id == channel.category_id:
                     position = max(position, pinned_channel.position)
             if channel.position != position + 1:
-                await channel.edit(position=position + 1)
+                self.bumps.bump(channel, position + 1)
+
+    # Prune spaces whose channel was deleted
+    @commands.Cog.listener()
+    @metrics.listener
+    async def on_guild_channel_delete(self, channel):
+        if not cache.spaces.is_loaded(channel.guild.id) or cache.spaces.get(
+            channel.guild.id, channel.id
+        ):
+            hygiene.space_deleted(channel.guild.id, channel.id)
+
+    # Flag spaces whose owner left
+    @commands.Cog.listener()
+    @metrics.listener
+    async def on_member_remove(self, member):
+        if not cache.spaces.is_loaded(member.guild.id) or cache.spaces.is_owner(
+            member.guild.id, member.id
+        ):
+            hygiene.owner_left(
+                member.guild.id, member.id, discord.utils.utcnow().timestamp()
+            )
+
+    # Unflag spaces whose owner came back
+    @commands.Cog.listener()
+    @metrics.listener
+    async def on_member_join(self, member):
+        if not cache.spaces.is_loaded(member.guild.id) or cache.spaces.is_owner(
+            member.guild.id, member.id
+        ):
+            hygiene.owner_returned(member.guild.id, member.id)
+
+    # Flag a guild the bot was removed from, keeping its spaces for a while
+    @commands.Cog.listener()
+    @metrics.listener
+    async def on_guild_remove(self, guild):
+        hygiene.guild_removed(guild.id, discord.utils.utcnow().timestamp())
+
+    # Unflag a guild the bot came back to
+    @commands.Cog.listener()
+    @metrics.listener
+    async def on_guild_join(self, guild):
+        hygiene.guild_returned(guild.id)
 
     # Display guild info
     @guild_group.command(
@@ -191,19 +409,25 @@ class Cockpit(commands.Cog):
         ):
             return
 
+        owner = owner or ctx.author
         owner_db = Owner()
-        await owner_db.async_init(ctx.guild.id, owner.id)
+        await owner_db.async_count(ctx.guild.id, owner.id)
         if not await owner_db.check_max_spaces(ctx, guild_db.max_spaces_per_owner):
             return
 
-        owner = owner or ctx.author
         name = name or f"{owner.display_name}-space"
         category = ctx.guild.get_channel(guild_db.space_category_id)
-        space = await category.create_text_channel(
-            name,
-            overwrites=Cockpit.overwrites(
-                owner, ctx.guild, guild_db.whitelisted_role_ids
+        space = await mutations.queue.submit(
+            ctx.guild.id,
+            None,
+            functools.partial(
+                category.create_text_channel,
+                name,
+                overwrites=Cockpit.overwrites(
+                    owner, ctx.guild, guild_db.whitelisted_role_ids
+                ),
             ),
+            mutations.INTERACTIVE,
         )
 
         await Space.add(
@@ -215,11 +439,18 @@ class Cockpit(commands.Cog):
                 guild_db.bump_on_thread_message,
             )
         )
+        members.remember(ctx.guild, owner.id)
 
         space_owner_role = ctx.guild.get_role(guild_db.space_owner_role_id)
         if space_owner_role:
             try:
-                await owner.add_roles(space_owner_role)
+                await mutations.queue.submit(
+                    ctx.guild.id,
+                    ("add_roles", owner.id, (space_owner_role.id,)),
+                    functools.partial(owner.add_roles, space_owner_role),
+                    mutations.INTERACTIVE,
+                    "roles",
+                )
             except discord.Forbidden:
                 await ctx.send_followup(
                     embed=discord.Embed(
@@ -234,7 +465,7 @@ class Cockpit(commands.Cog):
                 description=f"{space.mention} was successfully created for {owner.mention}.",
                 color=discord.Colour.green(),
             ),
-            ephemeral=True
+            ephemeral=True,
         )
         await ctx.channel.send(
             owner.mention,
@@ -269,7 +500,7 @@ class Cockpit(commands.Cog):
             return
 
         owner_db = Owner()
-        await owner_db.async_init(ctx.guild.id, owner.id)
+        await owner_db.async_count(ctx.guild.id, owner.id)
         if not await owner_db.check_max_spaces(ctx, guild_db.max_spaces_per_owner):
             return
 
@@ -282,11 +513,18 @@ class Cockpit(commands.Cog):
                 guild_db.bump_on_thread_message,
             )
         )
+        members.remember(ctx.guild, owner.id)
 
         space_owner_role = ctx.guild.get_role(guild_db.space_owner_role_id)
         if space_owner_role:
             try:
-                await owner.add_roles(space_owner_role)
+                await mutations.queue.submit(
+                    ctx.guild.id,
+                    ("add_roles", owner.id, (space_owner_role.id,)),
+                    functools.partial(owner.add_roles, space_owner_role),
+                    mutations.INTERACTIVE,
+                    "roles",
+                )
             except discord.Forbidden:
                 await ctx.send_followup(
                     embed=discord.Embed(
@@ -329,6 +567,7 @@ class Cockpit(commands.Cog):
             return
 
         await space_db.set_owner(owner.id)
+        members.remember(ctx.guild, owner.id)
 
         await ctx.send_followup(
             embed=discord.Embed(
@@ -381,7 +620,7 @@ class Cockpit(commands.Cog):
         propagate: discord.Option(
             bool,
             "Whether to add/remove the role from all space owners",
-            default="False",
+            default=False,
         ),
     ):
         await ctx.defer()
@@ -392,25 +631,21 @@ class Cockpit(commands.Cog):
             if guild_db.space_owner_role_id == role.id:
                 await guild_db.set_owner_role(None)
                 if propagate:
-                    for member in ctx.guild.members:
-                        owner_db = Owner()
-                        await owner_db.async_init(ctx.guild.id, member.id)
-                        if owner_db.exists and role in member.roles:
-                            try:
-                                await member.remove_roles(role)
-                            except discord.Forbidden:
-                                await ctx.send_followup(
-                                    embed=discord.Embed(
-                                        description=f"Failed to modify {role.mention} for {member.mention}.",
-                                        color=discord.Colour.red(),
-                                    )
-                                )
-                                return
-                    await ctx.send_followup(
-                        embed=discord.Embed(
-                            description="Role for space owners removed and unset.",
+                    owners = await self.owners(ctx.guild)
+                    summary = await self.propagate_roles(
+                        ctx,
+                        [
+                            (member, [], [role])
+                            for member in owners
+                            if role in member.roles
+                        ],
+                    )
+                    await Cockpit.followup(
+                        ctx,
+                        discord.Embed(
+                            description=f"Role for space owners removed and unset.\n{summary}",
                             color=discord.Colour.green(),
-                        )
+                        ),
                     )
                 else:
                     await ctx.send_followup(
@@ -426,36 +661,29 @@ class Cockpit(commands.Cog):
                     )
                 await guild_db.set_owner_role(role.id)
                 if propagate:
-                    for member in ctx.guild.members:
-                        owner_db = Owner()
-                        await owner_db.async_init(ctx.guild.id, member.id)
-                        if owner_db.exists and role not in member.roles:
-                            if old_space_owner_role:
-                                try:
-                                    await member.remove_roles(old_space_owner_role)
-                                except discord.Forbidden:
-                                    await ctx.send_followup(
-                                        embed=discord.Embed(
-                                            description=f"Failed to modify {old_space_owner_role.mention} for {member.mention}.",
-                                            color=discord.Colour.red(),
-                                        )
-                                    )
-                                    return
-                            try:
-                                await member.add_roles(role)
-                            except discord.Forbidden:
-                                await ctx.send_followup(
-                                    embed=discord.Embed(
-                                        description=f"Failed to modify {role.mention} for {member.mention}.",
-                                        color=discord.Colour.red(),
-                                    )
-                                )
-                                return
-                    await ctx.send_followup(
-                        embed=discord.Embed(
-                            description=f"Role for space owners added and set to {role.mention}.",
+                    owners = await self.owners(ctx.guild)
+                    summary = await self.propagate_roles(
+                        ctx,
+                        [
+                            (
+                                member,
+                                [role],
+                                (
+                                    [old_space_owner_role]
+                                    if old_space_owner_role in member.roles
+                                    else []
+                                ),
+                            )
+                            for member in owners
+                            if role not in member.roles
+                        ],
+                    )
+                    await Cockpit.followup(
+                        ctx,
+                        discord.Embed(
+                            description=f"Role for space owners added and set to {role.mention}.\n{summary}",
                             color=discord.Colour.green(),
-                        )
+                        ),
                     )
                 else:
                     await ctx.send_followup(
@@ -602,7 +830,15 @@ class Cockpit(commands.Cog):
     @guild_group.command(
         name="sort-spaces", description="Sorts spaces by activity in descending order"
     )
-    async def sort(self, ctx):
+    async def sort(
+        self,
+        ctx,
+        dry_run: discord.Option(
+            bool,
+            "Whether to only report the planned moves and their cost",
+            required=False,
+        ),
+    ):
         # this'll take a while
         await ctx.defer()
 
@@ -613,19 +849,26 @@ class Cockpit(commands.Cog):
         ):
             return
 
-        if ctx.guild.get_channel(guild_db.space_category_id):
-            channels = ctx.guild.get_channel(guild_db.space_category_id).text_channels
+        category = ctx.guild.get_channel(guild_db.space_category_id)
+        if category:
+            channels = category.text_channels
             pinned_channels = []
             spaces = []
+            space_dbs = await Space.get_many(
+                ctx.guild.id,
+                [
+                    channel.id
+                    for channel in channels
+                    if channel.id not in guild_db.pinned_channel_ids
+                ],
+            )
 
             for channel in channels:
                 if channel.id in guild_db.pinned_channel_ids:
                     pinned_channels.append(channel.id)
                     continue
 
-                space_db = Space()
-                await space_db.async_init(channel.id, channel.guild.id)
-                if space_db.exists:
+                if channel.id in space_dbs:
                     spaces.append(channel)
 
             if not spaces:
@@ -634,25 +877,27 @@ class Cockpit(commands.Cog):
                 )
                 return
 
-        first_pos = channels[0].position
         channel_timestamps = {}
         empty_channel_timestamps = {}
+        last_active = await activity.ledger.get(ctx.guild.id)
 
+        # Only scan spaces the ledger has never seen
+        unseen = []
         for space in spaces:
-            try:
-                message = await space.fetch_message(space.last_message_id)
-                timestamp = message.created_at
-
-                for thread in space.threads:
-                    thread_message = await thread.fetch_message(thread.last_message_id)
-                    thread_timestamp = thread_message.created_at
-                    if thread_timestamp > timestamp:
-                        timestamp = thread_timestamp
-
+            if space.id in last_active:
+                channel_timestamps[space.id] = datetime.fromtimestamp(
+                    last_active[space.id], timezone.utc
+                )
+            else:
+                unseen.append(space)
+        scanned = await activity.scan(unseen, THREAD_SCAN_CONCURRENCY)
+        for space in unseen:
+            timestamp = scanned[space.id]
+            if timestamp is None:
+                empty_channel_timestamps[space.id] = space.created_at
+            else:
                 channel_timestamps[space.id] = timestamp
-            except (discord.NotFound, discord.HTTPException) as e:
-                if e.code in [10008, 50013]:
-                    empty_channel_timestamps[space.id] = channel.created_at
+                activity.ledger.record(ctx.guild.id, space.id, timestamp.timestamp())
 
         ordered_channels = (
             pinned_channels
@@ -662,10 +907,41 @@ class Cockpit(commands.Cog):
             )
         )
 
-        for i, id in enumerate(ordered_channels):
-            channel = ctx.guild.get_channel(id)
-            if channel.position != first_pos + i:
-                await channel.edit(position=first_pos + i)
+        ordered_ids = set(ordered_channels)
+        target = [ctx.guild.get_channel(id) for id in ordered_channels] + [
+            channel for channel in channels if channel.id not in ordered_ids
+        ]
+        moves = plan_moves(
+            [channel.id for channel in channels], [channel.id for channel in target]
+        )
+
+        if dry_run:
+            payload = Cockpit.positions(category, target)
+            plan = "\n".join(
+                f"<#{id}> to the top" if after is None else f"<#{id}> after <#{after}>"
+                for id, after in moves[:20]
+            )
+            if len(moves) > 20:
+                plan += f"\n…and {len(moves) - 20} more"
+            await ctx.send_followup(
+                embed=discord.Embed(
+                    title="Sort plan",
+                    description=f"""{plan or "Spaces are already sorted."}
+
+                    Moves: **{len(moves)}** of {len(channels)} channels
+                    Estimated cost: **{1 if payload else 0}** bulk request updating **{len(payload)}** positions (vs **{len(moves)}** single moves)""",
+                ),
+            )
+            return
+
+        if moves:
+            await mutations.queue.submit(
+                ctx.guild.id,
+                ("sort", guild_db.space_category_id),
+                functools.partial(self.reorder, category, target),
+                mutations.BULK,
+                "positions",
+            )
 
         await ctx.send_followup(
             embed=discord.Embed(
@@ -690,55 +966,40 @@ class Cockpit(commands.Cog):
     ):
         await ctx.defer()
 
-        async with aiosqlite.connect("data/database.db") as db:
-            async with db.execute(
-                "SELECT space_id, owner_id FROM spaces WHERE guild_id = ?",
-                (ctx.guild.id,),
-            ) as cursor:
-                rows = await cursor.fetchall()
-                if rows:
-                    space_ids = [row[0] for row in rows]
-                    space_ids_to_clean = []
-                    for space_id in space_ids:
-                        if not ctx.guild.get_channel(space_id):
-                            space_ids_to_clean.append(space_id)
-                    if space_ids_to_clean:
-                        space_params = ", ".join("?" * len(space_ids_to_clean))
-                        await db.execute(
-                            f"DELETE FROM spaces WHERE space_id IN ({space_params})",
-                            space_ids_to_clean,
-                        )
-                        await db.commit()
-                    if ignore_owners:
-                        await ctx.send_followup(
-                            embed=discord.Embed(
-                                description=f"{len(space_ids_to_clean)} spaces cleaned from the database.",
-                                color=discord.Colour.green(),
-                            )
-                        )
-                    else:
-                        owner_ids = [row[1] for row in rows]
-                        owner_ids_to_clean = []
-                        for owner_id in owner_ids:
-                            if not ctx.guild.get_member(owner_id):
-                                owner_ids_to_clean.append(owner_id)
-                        if owner_ids_to_clean:
-                            owner_params = ", ".join("?" * len(owner_ids_to_clean))
-                            await db.execute(
-                                f"DELETE FROM spaces WHERE owner_id IN ({owner_params})",
-                                owner_ids_to_clean,
-                            )
-                            await db.commit()
-                            await ctx.send_followup(
-                                embed=discord.Embed(
-                                    description=f"{len(space_ids_to_clean)} spaces and {len(owner_ids_to_clean)} owners cleaned from the database.",
-                                    color=discord.Colour.green(),
-                                )
-                            )
-                else:
-                    await ctx.send_followup(
-                        embed=discord.Embed(description="There are no spaces to clean.")
-                    )
+        member_ids = None
+        if not ignore_owners:
+            try:
+                member_ids = [member.id for member in await self.owners(ctx.guild)]
+            except asyncio.TimeoutError:
+                # Fall back to the departed-owner flags
+                logger.warning(f"Timed out resolving owners of guild {ctx.guild.id}.")
+
+        space_ids, owner_space_ids, owner_ids = await db.reconcile_spaces(
+            ctx.guild.id,
+            [channel.id for channel in ctx.guild.channels],
+            member_ids,
+            not ignore_owners,
+        )
+        cache.spaces.remove(ctx.guild.id, space_ids | owner_space_ids)
+
+        if not (space_ids or owner_space_ids):
+            await ctx.send_followup(
+                embed=discord.Embed(description="There are no spaces to clean.")
+            )
+        elif ignore_owners:
+            await ctx.send_followup(
+                embed=discord.Embed(
+                    description=f"{len(space_ids)} spaces cleaned from the database.",
+                    color=discord.Colour.green(),
+                )
+            )
+        else:
+            await ctx.send_followup(
+                embed=discord.Embed(
+                    description=f"{len(space_ids | owner_space_ids)} spaces and {len(owner_ids)} owners cleaned from the database.",
+                    color=discord.Colour.green(),
+                )
+            )
 
     # Create space for self
     @space_group.command(name="create", description="Creates a space given an owner")
@@ -759,17 +1020,23 @@ class Cockpit(commands.Cog):
             return
 
         owner_db = Owner()
-        await owner_db.async_init(ctx.guild.id, ctx.author.id)
+        await owner_db.async_count(ctx.guild.id, ctx.author.id)
         if not await owner_db.check_max_spaces(ctx, guild_db.max_spaces_per_owner):
             return
 
         name = name or f"{ctx.author.display_name}-space"
         category = ctx.guild.get_channel(guild_db.space_category_id)
-        space = await category.create_text_channel(
-            name,
-            overwrites=Cockpit.overwrites(
-                ctx.author, ctx.guild, guild_db.whitelisted_role_ids
+        space = await mutations.queue.submit(
+            ctx.guild.id,
+            None,
+            functools.partial(
+                category.create_text_channel,
+                name,
+                overwrites=Cockpit.overwrites(
+                    ctx.author, ctx.guild, guild_db.whitelisted_role_ids
+                ),
             ),
+            mutations.INTERACTIVE,
         )
 
         await Space.add(
@@ -781,11 +1048,18 @@ class Cockpit(commands.Cog):
                 guild_db.bump_on_thread_message,
             )
         )
+        members.remember(ctx.guild, ctx.author.id)
 
         space_owner_role = ctx.guild.get_role(guild_db.space_owner_role_id)
         if space_owner_role:
             try:
-                await ctx.author.add_roles(space_owner_role)
+                await mutations.queue.submit(
+                    ctx.guild.id,
+                    ("add_roles", ctx.author.id, (space_owner_role.id,)),
+                    functools.partial(ctx.author.add_roles, space_owner_role),
+                    mutations.INTERACTIVE,
+                    "roles",
+                )
             except discord.Forbidden:
                 await ctx.send_followup(
                     embed=discord.Embed(
@@ -827,10 +1101,16 @@ class Cockpit(commands.Cog):
         if not await space_db.check_exists(ctx, True):
             return
 
-        await space.edit(
-            overwrites=Cockpit.overwrites(
-                ctx.author, ctx.guild, guild_db.whitelisted_role_ids
-            )
+        await mutations.queue.submit(
+            ctx.guild.id,
+            ("overwrites", space.id),
+            functools.partial(
+                space.edit,
+                overwrites=Cockpit.overwrites(
+                    ctx.author, ctx.guild, guild_db.whitelisted_role_ids
+                ),
+            ),
+            mutations.INTERACTIVE,
         )
 
         await ctx.send_followup(
@@ -848,11 +1128,20 @@ class Cockpit(commands.Cog):
     async def create(
         self,
         ctx,
-        space: discord.Option(discord.TextChannel, "The space to configure"),
+        space: discord.Option(
+            str, "The space to configure", autocomplete=autocomplete.owned_spaces
+        ),
         value: discord.Option(bool, "The value to set"),
     ):
         await ctx.defer()
 
+        space = autocomplete.space_channel(ctx.guild, space)
+        if space is None:
+            await ctx.send_followup(
+                embed=discord.Embed(description="Pick one of your spaces."),
+            )
+            return
+
         space_db = Space()
         await space_db.async_init(space.id, space.guild.id)
         if await space_db.check_exists(ctx, True) and await space_db.check_owner(ctx):
@@ -872,11 +1161,20 @@ class Cockpit(commands.Cog):
     async def create(
         self,
         ctx,
-        space: discord.Option(discord.TextChannel, "The space to configure"),
+        space: discord.Option(
+            str, "The space to configure", autocomplete=autocomplete.owned_spaces
+        ),
         value: discord.Option(bool, "The value to set"),
     ):
         await ctx.defer()
 
+        space = autocomplete.space_channel(ctx.guild, space)
+        if space is None:
+            await ctx.send_followup(
+                embed=discord.Embed(description="Pick one of your spaces."),
+            )
+            return
+
         space_db = Space()
         await space_db.async_init(space.id, space.guild.id)
         if await space_db.check_exists(ctx, True) and await space_db.check_owner(ctx):
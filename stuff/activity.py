@@ -0,0 +1,95 @@
+import asyncio
+
+import discord
+from loguru import logger
+
+from stuff import db
+from stuff.config import ACTIVITY_FLUSH_INTERVAL
+
+# Archived threads per channel to scan, one REST page; Discord returns the most
+# recently archived first
+ARCHIVED_THREADS = 100
+
+
+# Time of the newest message in any of the channels, decoded from the
+# last_message_id snowflakes, or None if none of them has a message
+def latest(channels):
+    ids = [channel.last_message_id for channel in channels if channel.last_message_id]
+    return discord.utils.snowflake_time(max(ids)) if ids else None
+
+
+# Newest activity per channel across the channel, its active threads and its
+# recently archived threads, fetching at most concurrency archives at a time
+async def scan(channels, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scan_channel(channel):
+        threads = list(channel.threads)
+        async with semaphore:
+            try:
+                async for thread in channel.archived_threads(limit=ARCHIVED_THREADS):
+                    threads.append(thread)
+            except discord.HTTPException as e:
+                logger.debug(f"Skipped archived threads of {channel.id}: {e}")
+        return channel.id, latest([channel, *threads])
+
+    return dict(await asyncio.gather(*map(scan_channel, channels)))
+
+
+# Buffers last-activity timestamps per space and writes them in batches
+class ActivityLedger:
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}
+        self.task = None
+
+    def record(self, guild_id, space_id, timestamp):
+        self.record_pending(guild_id, space_id, timestamp)
+        if self.task is None:
+            self.task = asyncio.create_task(self.flush_later())
+
+    # Keep the newest timestamp per space
+    def record_pending(self, guild_id, space_id, timestamp):
+        current = self.pending.get(space_id)
+        if current is None or current[1] < timestamp:
+            self.pending[space_id] = (guild_id, timestamp)
+
+    async def flush_later(self):
+        await asyncio.sleep(self.interval)
+        self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            # flush kept the timestamps, so try them again next interval
+            logger.exception("Failed to flush activity, retrying.")
+            if self.task is None:
+                self.task = asyncio.create_task(self.flush_later())
+
+    async def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        try:
+            await db.record_activity(
+                [
+                    (space_id, guild_id, timestamp)
+                    for space_id, (guild_id, timestamp) in pending.items()
+                ]
+            )
+        except Exception:
+            # Keep them for the next flush, along with any recorded meanwhile
+            for space_id, (guild_id, timestamp) in pending.items():
+                self.record_pending(guild_id, space_id, timestamp)
+            raise
+        logger.debug(f"Flushed activity for {len(pending)} spaces.")
+
+    # Last activity per space in a guild, including unflushed entries
+    async def get(self, guild_id):
+        timestamps = await db.get_activity(guild_id)
+        for space_id, (pending_guild_id, timestamp) in self.pending.items():
+            if pending_guild_id == guild_id:
+                timestamps[space_id] = max(timestamp, timestamps.get(space_id, 0))
+        return timestamps
+
+
+ledger = ActivityLedger(ACTIVITY_FLUSH_INTERVAL)
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import aiohttp
+from loguru import logger
+
+from stuff.config import (
+    GREET_CACHE_DIR,
+    GREET_CACHE_MAX_BYTES,
+    GREET_DOWNLOAD_TIMEOUT,
+    GREET_FILE_MAX_BYTES,
+)
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+# What a failed download raises; aiohttp timeouts are not ClientErrors
+ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, AttachmentTooLarge)
+
+
+# Content-addressed on-disk cache of greet attachments with LRU eviction
+class AttachmentCache:
+    def __init__(self, directory, max_bytes, max_file_bytes, timeout):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.timeout = timeout
+        self.index_path = os.path.join(directory, "index.json")
+        self.urls = None
+        self.session = None
+        self.locks = {}
+        self.index_lock = asyncio.Lock()
+
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self, urls):
+        with open(self.index_path, "w") as f:
+            json.dump(urls, f)
+
+    async def ensure_loaded(self):
+        if self.urls is None:
+            urls = await asyncio.to_thread(self.load)
+            if self.urls is None:
+                self.urls = urls
+
+    # Write the index from a snapshot taken under the lock, so the newest
+    # snapshot is the one that lands last
+    async def store_index(self):
+        async with self.index_lock:
+            await asyncio.to_thread(self.save, dict(self.urls))
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    # Get an attachment's bytes, downloading it only on a miss
+    async def get(self, url):
+        await self.ensure_loaded()
+        async with self.locks.setdefault(url, asyncio.Lock()):
+            digest = self.urls.get(url)
+            if digest:
+                content = await asyncio.to_thread(self.read, digest)
+                if content is not None:
+                    return content
+
+            content = await self.download(url)
+            digest = hashlib.sha256(content).hexdigest()
+            await asyncio.to_thread(self.write, digest, content)
+            self.urls[url] = digest
+            evicted = await asyncio.to_thread(self.evict, set(self.urls.values()))
+            if evicted:
+                self.urls = {u: d for u, d in self.urls.items() if d not in evicted}
+            await self.store_index()
+            return content
+
+    async def warm(self, url):
+        try:
+            await self.get(url)
+        except ERRORS as e:
+            logger.warning(f"Failed to cache greet attachment {url}: {e!r}")
+
+    # Forget a URL, deleting its file unless another URL has the same content
+    async def purge(self, url):
+        await self.ensure_loaded()
+        digest = self.urls.pop(url, None)
+        self.locks.pop(url, None)
+        if digest is None:
+            return
+        await self.store_index()
+        if digest not in self.urls.values():
+            await asyncio.to_thread(self.remove, digest)
+
+    async def download(self, url):
+        if self.session is None:
+            # Bound the whole download, so a stalled host releases the URL's lock
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        async with self.session.get(url, raise_for_status=True) as response:
+            if (response.content_length or 0) > self.max_file_bytes:
+                raise AttachmentTooLarge(f"{response.content_length} bytes")
+            # Read to EOF in chunks, since the length header may be missing
+            content = bytearray()
+            async for chunk in response.content.iter_any():
+                content += chunk
+                if len(content) > self.max_file_bytes:
+                    raise AttachmentTooLarge(f"over {self.max_file_bytes} bytes")
+            return bytes(content)
+
+    # A cached file's bytes, touching it since access time drives eviction, or
+    # None if it is gone
+    def read(self, digest):
+        try:
+            os.utime(self.path(digest))
+            with open(self.path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, digest, content):
+        with open(self.path(digest), "wb") as f:
+            f.write(content)
+
+    def remove(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    # Delete least recently used files among digests until the cache fits its
+    # budget; returns the deleted digests
+    def evict(self, digests):
+        files = []
+        for digest in digests:
+            try:
+                stat = os.stat(self.path(digest))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, digest))
+
+        evicted = set()
+        total = sum(size for _, size, _ in files)
+        for _, size, digest in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self.remove(digest)
+            total -= size
+            evicted.add(digest)
+            logger.info(f"Evicted greet attachment {digest} from cache.")
+        return evicted
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+cache = AttachmentCache(
+    GREET_CACHE_DIR, GREET_CACHE_MAX_BYTES, GREET_FILE_MAX_BYTES, GREET_DOWNLOAD_TIMEOUT
+)
@@ -0,0 +1,61 @@
+import discord
+
+from stuff import cache
+from stuff.db import Guild, Owner
+
+# Most choices Discord shows for an option
+LIMIT = 25
+
+
+# Values whose label starts with the typed text, then those containing it,
+# ignoring case
+def match(values, typed, label=str):
+    typed = (typed or "").lower()
+    prefix = []
+    substring = []
+    for value in values:
+        text = label(value).lower()
+        if text.startswith(typed):
+            prefix.append(value)
+            if len(prefix) == LIMIT:
+                break
+        elif typed in text and len(substring) < LIMIT:
+            substring.append(value)
+    return (prefix + substring)[:LIMIT]
+
+
+# The guild's greet attachments, from the guild cache
+async def greet_attachments(ctx: discord.AutocompleteContext):
+    guild_id = ctx.interaction.guild.id
+    entry = cache.guilds.get(guild_id)
+    if entry is None:
+        guild_db = Guild()
+        await guild_db.async_init(guild_id)
+        entry = cache.guilds.get(guild_id) or {}
+    return match(entry.get("greet_attachments", ()), ctx.value)
+
+
+# The caller's spaces by channel name, from the space index once it's loaded
+async def owned_spaces(ctx: discord.AutocompleteContext):
+    guild = ctx.interaction.guild
+    owner_id = ctx.interaction.user.id
+    if cache.spaces.is_loaded(guild.id):
+        space_ids = cache.spaces.owned(guild.id, owner_id)
+    else:
+        owner_db = Owner()
+        await owner_db.async_init(guild.id, owner_id)
+        space_ids = [row.space_id for row in owner_db.spaces]
+
+    channels = filter(None, map(guild.get_channel, space_ids))
+    return [
+        discord.OptionChoice(f"#{channel.name}", str(channel.id))
+        for channel in match(channels, ctx.value, lambda channel: channel.name)
+    ]
+
+
+# Channel for an autocompleted space option, which holds its id, or None
+def space_channel(guild, value):
+    try:
+        return guild.get_channel(int(value.strip("<#>")))
+    except ValueError:
+        return None
@@ -0,0 +1,73 @@
+import asyncio
+
+import discord
+from loguru import logger
+
+
+# Record a bump target, keeping only the latest per channel and re-inserting so
+# the most recently bumped channel is applied last
+def add_bump(pending, channel, position):
+    pending.pop(channel.id, None)
+    pending[channel.id] = (channel, position)
+
+
+# Collects bump intents per guild and hands them to apply once per window
+class BumpScheduler:
+    def __init__(self, window, apply):
+        self.window = window
+        self.apply = apply
+        self.pending = {}
+        self.tasks = {}
+        self.requested = 0
+        self.applied = 0
+        self.failed = 0
+
+    # Queue a bump, keeping only the latest target per channel
+    def bump(self, channel, position):
+        add_bump(self.pending.setdefault(channel.guild.id, {}), channel, position)
+        self.requested += 1
+
+        if channel.guild.id not in self.tasks:
+            self.tasks[channel.guild.id] = asyncio.create_task(
+                self.flush_later(channel.guild.id)
+            )
+
+    async def flush_later(self, guild_id):
+        await asyncio.sleep(self.window)
+        await self.flush(guild_id)
+
+    async def flush(self, guild_id):
+        self.tasks.pop(guild_id, None)
+        pending = self.pending.pop(guild_id, {})
+        bumps = [
+            (channel, position)
+            for channel, position in pending.values()
+            if channel.position != position
+        ]
+        if not bumps:
+            return
+        try:
+            self.applied += await self.apply(guild_id, bumps)
+        except discord.HTTPException as e:
+            self.failed += 1
+            logger.warning(f"Failed to bump spaces in guild {guild_id}: {e}")
+        except Exception as e:
+            # Nobody awaits this task, so log it here
+            self.failed += 1
+            logger.opt(exception=e).error(f"Failed to bump spaces in guild {guild_id}.")
+        logger.debug(f"Flushed bumps for guild {guild_id}: {self.stats()}")
+
+    # Drop everything still waiting, e.g. when the cog is unloaded
+    def cancel(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        self.pending.clear()
+
+    def stats(self):
+        return {
+            "requested": self.requested,
+            "applied": self.applied,
+            "failed": self.failed,
+            "saved": self.requested - self.applied - self.failed,
+        }
@@ -0,0 +1,172 @@
+from loguru import logger
+
+# Shards guild ids are partitioned over, set by the bot once it knows the count
+shard_count = 1
+
+
+# Shard a guild belongs to, by Discord's sharding formula
+def shard_of(guild_id):
+    return (guild_id >> 22) % shard_count
+
+
+# Process-wide cache keyed by guild id, partitioned by shard, with hit/miss
+# counters
+class Cache:
+    def __init__(self, name):
+        self.name = name
+        self.shards = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.shards.get(shard_of(key), {}).get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.shards.setdefault(shard_of(key), {})[key] = entry
+
+    # Set one field of an entry in place, if the entry is cached
+    def update(self, key, field, value):
+        entry = self.shards.get(shard_of(key), {}).get(key)
+        if entry is not None:
+            entry[field] = value
+
+    # Add a value to one tuple field of an entry, if the entry is cached
+    def add(self, key, field, value):
+        entry = self.shards.get(shard_of(key), {}).get(key)
+        if entry is not None and value not in entry[field]:
+            entry[field] = (*entry[field], value)
+
+    # Remove a value from one tuple field of an entry, if the entry is cached
+    def discard(self, key, field, value):
+        entry = self.shards.get(shard_of(key), {}).get(key)
+        if entry is not None:
+            entry[field] = tuple(item for item in entry[field] if item != value)
+
+    # Drop one entry, one shard, or everything when neither is given
+    def invalidate(self, key=None, shard=None):
+        if key is not None:
+            self.shards.get(shard_of(key), {}).pop(key, None)
+        elif shard is not None:
+            self.shards.pop(shard, None)
+            logger.info(f"Invalidated {self.name} cache for shard {shard}.")
+        else:
+            self.shards.clear()
+            logger.info(f"Invalidated {self.name} cache.")
+
+    def __contains__(self, key):
+        return key in self.shards.get(shard_of(key), {})
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.shards.values())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "shards": {shard: len(entries) for shard, entries in self.shards.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Per-guild configuration, written through by the Guild setters
+guilds = Cache("guild")
+
+
+# Per-guild index of space_id -> (owner_id, bump_on_message, bump_on_thread_message),
+# partitioned by shard and loaded one shard at a time
+class SpaceIndex:
+    def __init__(self):
+        self.shards = {}
+        self.loaded = set()
+        self.hits = 0
+        self.misses = 0
+
+    def is_loaded(self, guild_id):
+        return shard_of(guild_id) in self.loaded
+
+    def spaces(self, guild_id):
+        return self.shards.get(shard_of(guild_id), {}).get(guild_id, {})
+
+    # Authoritative once loaded: a missing entry means the channel is not a space
+    def get(self, guild_id, space_id):
+        entry = self.spaces(guild_id).get(space_id)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, guild_id, space_id, entry):
+        guilds = self.shards.setdefault(shard_of(guild_id), {})
+        guilds.setdefault(guild_id, {})[space_id] = entry
+
+    def remove(self, guild_id, space_ids):
+        spaces = self.spaces(guild_id)
+        for space_id in space_ids:
+            spaces.pop(space_id, None)
+
+    def remove_guild(self, guild_id):
+        self.shards.get(shard_of(guild_id), {}).pop(guild_id, None)
+
+    # Whether anyone in the guild owns a space
+    def is_owner(self, guild_id, owner_id):
+        return any(entry[0] == owner_id for entry in self.spaces(guild_id).values())
+
+    # Ids of the spaces an owner has in the guild
+    def owned(self, guild_id, owner_id):
+        return [
+            space_id
+            for space_id, entry in self.spaces(guild_id).items()
+            if entry[0] == owner_id
+        ]
+
+    # Replace the given shards, or every shard, with rows from the database
+    def load(self, rows, shards=None):
+        shards = set(range(shard_count) if shards is None else shards)
+        for shard in shards:
+            self.shards.pop(shard, None)
+        for (
+            space_id,
+            guild_id,
+            owner_id,
+            bump_on_message,
+            bump_on_thread_message,
+        ) in rows:
+            self.put(
+                guild_id, space_id, (owner_id, bump_on_message, bump_on_thread_message)
+            )
+        self.loaded |= shards
+
+    def invalidate(self, shard=None):
+        if shard is None:
+            self.shards.clear()
+            self.loaded.clear()
+            logger.info("Invalidated space index.")
+        else:
+            self.shards.pop(shard, None)
+            self.loaded.discard(shard)
+            logger.info(f"Invalidated space index for shard {shard}.")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": sum(
+                len(spaces)
+                for guilds in self.shards.values()
+                for spaces in guilds.values()
+            ),
+            "shards": sorted(self.loaded),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+spaces = SpaceIndex()
@@ -0,0 +1,27 @@
+from environs import Env
+
+# Environmental variables
+env = Env()
+env.read_env()
+
+DB_READERS = env.int("DB_READERS", 4)
+BUMP_WINDOW = env.float("BUMP_WINDOW", 5.0)
+ACTIVITY_FLUSH_INTERVAL = env.float("ACTIVITY_FLUSH_INTERVAL", 30.0)
+GREET_CACHE_DIR = env.str("GREET_CACHE_DIR", "data/greet")
+GREET_CACHE_MAX_BYTES = env.int("GREET_CACHE_MAX_BYTES", 500 * 1024 * 1024)
+GREET_FILE_MAX_BYTES = env.int("GREET_FILE_MAX_BYTES", 25 * 1024 * 1024)
+GREET_DOWNLOAD_TIMEOUT = env.float("GREET_DOWNLOAD_TIMEOUT", 30.0)
+THREAD_SCAN_CONCURRENCY = env.int("THREAD_SCAN_CONCURRENCY", 8)
+HYGIENE_FLUSH_INTERVAL = env.float("HYGIENE_FLUSH_INTERVAL", 10.0)
+GUILD_GRACE_PERIOD = env.float("GUILD_GRACE_PERIOD", 30 * 24 * 60 * 60.0)
+GATEWAY_RECORD_PATH = env.str("GATEWAY_RECORD_PATH", "")
+METRICS_HOST = env.str("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = env.int("METRICS_PORT", 0)
+LOW_MEMORY = env.bool("LOW_MEMORY", False)
+DB_BUSY_TIMEOUT = env.float("DB_BUSY_TIMEOUT", 5.0)
+DB_PROFILE = env.str("DB_PROFILE", "balanced")
+WRITE_BEHIND_INTERVAL = env.float("WRITE_BEHIND_INTERVAL", 0.0)
+WRITE_BEHIND_MAX_OPERATIONS = env.int("WRITE_BEHIND_MAX_OPERATIONS", 100)
+SHARDED = env.bool("SHARDED", False)
+SHARD_COUNT = env.int("SHARD_COUNT", 0)
+SHARD_IDS = env.list("SHARD_IDS", [], subcast=int)
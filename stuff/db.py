@@ -1,79 +1,124 @@
-import json
+import time
+
 import discord
 
-import aiosqlite
 from loguru import logger
 
+from stuff import cache, metrics
+from stuff.config import GUILD_GRACE_PERIOD
+from stuff.storage import GUILD_COLUMNS, GUILD_LISTS, SPACE_FIELDS, SpaceRow
+
+# Where guilds, spaces and activity are kept, set once by the bot to a
+# stuff.storage.Storage such as stuff.sqlite.SQLiteStorage
+storage = None
 
-# Initialize database
+
+# Initialize database, upgrading it in place to the latest schema
+@metrics.query
 async def initialize_db():
-    async with aiosqlite.connect("data/database.db") as db:
-        await db.execute(
-            """
-                CREATE TABLE IF NOT EXISTS spaces (
-                    space_id INTEGER PRIMARY KEY,
-                    guild_id INTEGER,
-                    owner_id INTEGER,
-                    bump_on_message INTEGER,
-                    bump_on_thread_message INTEGER
-                );
-            """
-        )
-        await db.execute(
-            """
-                CREATE TABLE IF NOT EXISTS guilds (
-                    guild_id INTEGER PRIMARY KEY,
-                    greet_channel_id INTEGER,
-                    greet_message TEXT,
-                    greet_attachments TEXT,
-                    space_category_id INTEGER,
-                    space_owner_role_id INTEGER,
-                    max_spaces_per_owner INTEGER,
-                    pinned_channel_ids TEXT,
-                    whitelisted_role_ids TEXT,
-                    bump_on_message INTEGER,
-                    bump_on_thread_message INTEGER
-                );
-            """
-        )
+    await storage.initialize()
+
+
+# Add guilds to database in one batch, skipping those already there
+@metrics.query
+async def initialize_guilds(guilds):
+    added = await storage.add_guilds([guild.id for guild in guilds])
+    if added:
+        logger.info(f"Added {added} guilds to database.")
 
 
 # Add guild to database
 async def initialize_guild(guild):
-    async with aiosqlite.connect("data/database.db") as db:
-        async with db.execute(
-            "SELECT * FROM guilds WHERE guild_id = ?", (guild.id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row is None:
-                await db.execute(
-                    "INSERT INTO guilds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                    (
-                        guild.id,
-                        None,
-                        "",
-                        json.dumps([]),
-                        None,
-                        None,
-                        1,
-                        json.dumps([]),
-                        json.dumps([]),
-                        True,
-                        True,
-                    ),
-                )
-                await db.commit()
-                logger.info(f"Added {guild.name} (ID {guild.id}) to database.")
+    await initialize_guilds([guild])
+
+
+# Load the configuration of every guild, or of the given shards' guilds, into
+# the guild cache
+@metrics.query
+async def load_guilds(shard_ids=None):
+    if shard_ids is None:
+        cache.guilds.invalidate()
+    else:
+        for shard_id in shard_ids:
+            cache.guilds.invalidate(shard=shard_id)
+    for row, lists in await storage.get_guilds(shard_ids=shard_ids):
+        guild_db = Guild()
+        guild_db.load(row, lists)
+        guild_db.to_cache()
+    logger.info(f"Cached configuration for {len(cache.guilds)} guilds.")
+
+
+# Load every space, or the given shards' spaces, into the space index
+@metrics.query
+async def load_spaces(shard_ids=None):
+    cache.spaces.load(await storage.get_spaces(shard_ids=shard_ids), shard_ids)
+    logger.info(f"Indexed {cache.spaces.stats()['entries']} spaces.")
+
+
+# Migrate, register guilds and fill the caches for every shard or the given
+# ones, once per shard
+async def bootstrap(guilds, shard_ids=None):
+    await initialize_db()
+    await initialize_guilds(guilds)
+    await purge_guilds()
+    await load_guilds(shard_ids)
+    await load_spaces(shard_ids)
+
+
+# Record last-activity timestamps, keeping the newest per space
+@metrics.query
+async def record_activity(rows):
+    await storage.record_activity(rows)
 
 
-# Get greetings attachments for autocomplete
-async def autocomplete_greet_attachment(ctx: discord.commands.AutocompleteContext):
-    guild_db = Guild()
-    await guild_db.async_init(ctx.interaction.guild.id)
-    return guild_db.greet_attachments
+# Get last-activity timestamps for a guild's spaces
+@metrics.query
+async def get_activity(guild_id):
+    return await storage.get_activity(guild_id)
+
+
+# Get the distinct owners of a guild's spaces
+@metrics.query
+async def get_owner_ids(guild_id):
+    return await storage.get_owner_ids(guild_id)
+
+
+# Prune deleted spaces and flag removed guilds and departed owners, in one
+# batch; guilds and owners map to when they left, or None when they came back
+@metrics.query
+async def prune_spaces(space_ids, guilds, owners):
+    await storage.prune_spaces(space_ids, guilds, owners)
+
+
+# Delete the spaces of guilds the bot was removed from over the grace period
+# ago, and drop them from the space index
+@metrics.query
+async def purge_guilds():
+    guild_ids = await storage.purge_guilds(time.time() - GUILD_GRACE_PERIOD)
+    for guild_id in guild_ids:
+        cache.spaces.remove_guild(guild_id)
+    if guild_ids:
+        logger.info(f"Purged the spaces of {len(guild_ids)} removed guilds.")
+
+
+# Delete a guild's spaces whose channel is gone and, if check_owners, whose
+# owner is not a member, or is flagged as departed when member_ids is None
+@metrics.query
+async def reconcile_spaces(guild_id, channel_ids, member_ids, check_owners=True):
+    return await storage.reconcile_spaces(
+        guild_id, channel_ids, member_ids, check_owners
+    )
+
+
+# Copy a row's named fields onto a record
+def fill(record, row):
+    for field, value in zip(row._fields, row):
+        setattr(record, field, value)
 
 
 class Guild:
+    __slots__ = (*GUILD_COLUMNS, *GUILD_LISTS, "exists")
+
     def __init__(self):
         self.guild_id = None
         self.greet_channel_id = None
@@ -88,149 +133,107 @@ class Guild:
         self.bump_on_thread_message = None
         self.exists = False
 
+    @metrics.query
     async def async_init(self, guild_id):
         self.guild_id = guild_id
-        async with aiosqlite.connect("data/database.db") as db:
-            async with db.execute(
-                "SELECT * FROM guilds WHERE guild_id = ?",
-                (guild_id,),
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row is not None:
-                    self.greet_channel_id = row[1]
-                    self.greet_message = row[2]
-                    self.greet_attachments = json.loads(row[3])
-                    self.space_category_id = row[4]
-                    self.space_owner_role_id = row[5]
-                    self.max_spaces_per_owner = row[6]
-                    self.pinned_channel_ids = json.loads(row[7])
-                    self.whitelisted_role_ids = json.loads(row[8])
-                    self.bump_on_message = row[9]
-                    self.bump_on_thread_message = row[10]
-                    self.exists = True
-
+        entry = cache.guilds.get(guild_id)
+        if entry is not None:
+            for key, value in entry.items():
+                setattr(self, key, list(value) if isinstance(value, tuple) else value)
+            return
+
+        for row, lists in await storage.get_guilds([guild_id]):
+            self.load(row, lists)
+            # Another command may have cached and changed it while we read
+            if guild_id not in cache.guilds:
+                self.to_cache()
+
+    def load(self, row, lists):
+        fill(self, row)
+        for attribute in GUILD_LISTS:
+            setattr(self, attribute, lists.get(attribute, []))
+        self.exists = True
+
+    # Cache this guild's whole state, as loaded from storage
+    def to_cache(self):
+        entry = {}
+        for key in self.__slots__:
+            value = getattr(self, key)
+            entry[key] = tuple(value) if isinstance(value, list) else value
+        cache.guilds.put(self.guild_id, entry)
+
+    # Store one setting, then update this guild and that field of the cache,
+    # leaving fields other commands changed meanwhile alone
+    async def update(self, column, value):
+        await storage.update_guild(self.guild_id, {column: value})
+        setattr(self, column, value)
+        cache.guilds.update(self.guild_id, column, value)
+
+    async def add_to_list(self, attribute, value):
+        values = getattr(self, attribute)
+        if value not in values:
+            values.append(value)
+            await storage.add_to_guild_list(self.guild_id, attribute, value)
+            cache.guilds.add(self.guild_id, attribute, value)
+
+    async def remove_from_list(self, attribute, value):
+        values = getattr(self, attribute)
+        if value in values:
+            values.remove(value)
+            await storage.remove_from_guild_list(self.guild_id, attribute, value)
+            cache.guilds.discard(self.guild_id, attribute, value)
+
+    @metrics.query
     async def set_greet_channel(self, channel_id):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET greet_channel_id = ? WHERE guild_id = ?",
-                (channel_id, self.guild_id),
-            )
-            await db.commit()
-            self.greet_channel_id = channel_id
+        await self.update("greet_channel_id", channel_id)
 
+    @metrics.query
     async def set_greet_message(self, message):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET greet_message = ? WHERE guild_id = ?",
-                (message, self.guild_id),
-            )
-            await db.commit()
-            self.greet_message = message
+        await self.update("greet_message", message)
 
+    @metrics.query
     async def add_to_greet_attachments(self, url):
-        if url not in self.greet_attachments:
-            self.greet_attachments.append(url)
-            async with aiosqlite.connect("data/database.db") as db:
-                await db.execute(
-                    "UPDATE guilds SET greet_attachments = ? WHERE guild_id = ?",
-                    (json.dumps(self.greet_attachments), self.guild_id),
-                )
-                await db.commit()
+        await self.add_to_list("greet_attachments", url)
 
+    @metrics.query
     async def remove_from_greet_attachments(self, url):
-        if url in self.greet_attachments:
-            self.greet_attachments.remove(url)
-            async with aiosqlite.connect("data/database.db") as db:
-                await db.execute(
-                    "UPDATE guilds SET greet_attachments = ? WHERE guild_id = ?",
-                    (json.dumps(self.greet_attachments), self.guild_id),
-                )
-                await db.commit()
+        await self.remove_from_list("greet_attachments", url)
 
+    @metrics.query
     async def set_category(self, category_id):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET space_category_id = ? WHERE guild_id = ?",
-                (category_id, self.guild_id),
-            )
-            await db.commit()
-            self.space_category_id = category_id
+        await self.update("space_category_id", category_id)
 
+    @metrics.query
     async def set_owner_role(self, role_id):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET space_owner_role_id = ? WHERE guild_id = ?",
-                (role_id, self.guild_id),
-            )
-            await db.commit()
-            self.space_owner_role_id = role_id
+        await self.update("space_owner_role_id", role_id)
 
+    @metrics.query
     async def set_max_spaces(self, value):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET max_spaces_per_owner = ? WHERE guild_id = ?",
-                (value, self.guild_id),
-            )
-            await db.commit()
-            self.max_spaces_per_owner = value
+        await self.update("max_spaces_per_owner", value)
 
+    @metrics.query
     async def add_to_pinned(self, channel_id):
-        if channel_id not in self.pinned_channel_ids:
-            self.pinned_channel_ids.append(channel_id)
-            async with aiosqlite.connect("data/database.db") as db:
-                await db.execute(
-                    "UPDATE guilds SET pinned_channel_ids = ? WHERE guild_id = ?",
-                    (json.dumps(self.pinned_channel_ids), self.guild_id),
-                )
-                await db.commit()
+        await self.add_to_list("pinned_channel_ids", channel_id)
 
+    @metrics.query
     async def remove_from_pinned(self, channel_id):
-        if channel_id in self.pinned_channel_ids:
-            self.pinned_channel_ids.remove(channel_id)
-            async with aiosqlite.connect("data/database.db") as db:
-                await db.execute(
-                    "UPDATE guilds SET pinned_channel_ids = ? WHERE guild_id = ?",
-                    (json.dumps(self.pinned_channel_ids), self.guild_id),
-                )
-                await db.commit()
+        await self.remove_from_list("pinned_channel_ids", channel_id)
 
+    @metrics.query
     async def add_to_whitelist(self, role_id):
-        if role_id not in self.whitelisted_role_ids:
-            self.whitelisted_role_ids.append(role_id)
-            async with aiosqlite.connect("data/database.db") as db:
-                await db.execute(
-                    "UPDATE guilds SET whitelisted_role_ids = ? WHERE guild_id = ?",
-                    (json.dumps(self.whitelisted_role_ids), self.guild_id),
-                )
-                await db.commit()
+        await self.add_to_list("whitelisted_role_ids", role_id)
 
+    @metrics.query
     async def remove_from_whitelist(self, role_id):
-        if role_id in self.whitelisted_role_ids:
-            self.whitelisted_role_ids.remove(role_id)
-            async with aiosqlite.connect("data/database.db") as db:
-                await db.execute(
-                    "UPDATE guilds SET whitelisted_role_ids = ? WHERE guild_id = ?",
-                    (json.dumps(self.whitelisted_role_ids), self.guild_id),
-                )
-                await db.commit()
+        await self.remove_from_list("whitelisted_role_ids", role_id)
 
+    @metrics.query
     async def set_bump(self, value):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET bump_on_message = ? WHERE guild_id = ?",
-                (value, self.guild_id),
-            )
-            await db.commit()
-            self.bump_on_message = value
+        await self.update("bump_on_message", value)
 
+    @metrics.query
     async def set_bump_thread(self, value):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE guilds SET bump_on_thread_message = ? WHERE guild_id = ?",
-                (value, self.guild_id),
-            )
-            await db.commit()
-            self.bump_on_thread_message = value
+        await self.update("bump_on_thread_message", value)
 
     async def check_exists(self, ctx):
         if self.exists:
@@ -267,6 +270,8 @@ class Guild:
 
 
 class Space:
+    __slots__ = (*SPACE_FIELDS, "exists")
+
     def __init__(self):
         self.space_id = None
         self.guild_id = None
@@ -275,57 +280,83 @@ class Space:
         self.bump_on_thread_message = None
         self.exists = False
 
+    @metrics.query
     async def add(data):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "INSERT INTO spaces VALUES (?, ?, ?, ?, ?)",
-                data,
-            )
-            await db.commit()
-
-    async def async_init(self, space_id, guild_id):
+        await storage.upsert_spaces([data])
+        space_id, guild_id, *entry = data
+        cache.spaces.put(guild_id, space_id, tuple(entry))
+
+    # Spaces among the given channel ids, by id, in one lookup
+    @metrics.query
+    async def get_many(guild_id, space_ids):
+        if cache.spaces.is_loaded(guild_id):
+            rows = []
+            for space_id in space_ids:
+                entry = cache.spaces.get(guild_id, space_id)
+                if entry is not None:
+                    rows.append(SpaceRow(space_id, guild_id, *entry))
+        else:
+            rows = await storage.get_spaces(guild_id, space_ids=space_ids)
+        spaces = {}
+        for row in rows:
+            space = spaces[row.space_id] = Space()
+            space.load(row)
+        return spaces
+
+    # Fill from the space index, returning False if it is not loaded yet
+    def from_index(self, space_id, guild_id):
         self.space_id = space_id
         self.guild_id = guild_id
-        async with aiosqlite.connect("data/database.db") as db:
-            async with db.execute(
-                "SELECT * FROM spaces WHERE guild_id = ? AND space_id = ?",
-                (guild_id, space_id),
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row is not None:
-                    self.space_id = row[0]
-                    self.guild_id = row[1]
-                    self.owner_id = row[2]
-                    self.bump_on_message = row[3]
-                    self.bump_on_thread_message = row[4]
-                    self.exists = True
+        if not cache.spaces.is_loaded(guild_id):
+            return False
+        entry = cache.spaces.get(guild_id, space_id)
+        if entry is not None:
+            self.owner_id, self.bump_on_message, self.bump_on_thread_message = entry
+            self.exists = True
+        return True
+
+    @metrics.query
+    async def async_init(self, space_id, guild_id):
+        if self.from_index(space_id, guild_id):
+            return
+
+        for row in await storage.get_spaces(guild_id, space_ids=[space_id]):
+            self.load(row)
 
+    def load(self, row):
+        fill(self, row)
+        self.exists = True
+
+    # Store fields, then update this space and the index
+    async def update(self, **values):
+        await storage.update_spaces([(self.space_id, values)])
+        for field, value in values.items():
+            setattr(self, field, value)
+        self.to_index()
+
+    @metrics.query
     async def set_owner(self, owner_id):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE spaces SET owner_id = ? WHERE space_id = ?",
-                (owner_id, self.space_id),
-            )
-            await db.commit()
-            self.owner_id = owner_id
+        await storage.update_spaces(
+            [(self.space_id, {"owner_id": owner_id, "owner_left_at": None})]
+        )
+        self.owner_id = owner_id
+        self.to_index()
 
+    @metrics.query
     async def set_bump(self, value):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE spaces SET bump_on_message = ? WHERE space_id = ?",
-                (value, self.space_id),
-            )
-            await db.commit()
-            self.bump_on_message = value
+        await self.update(bump_on_message=value)
 
+    @metrics.query
     async def set_bump_thread(self, value):
-        async with aiosqlite.connect("data/database.db") as db:
-            await db.execute(
-                "UPDATE spaces SET bump_on_thread_message = ? WHERE space_id = ?",
-                (value, self.space_id),
-            )
-            await db.commit()
-            self.bump_on_thread_message = value
+        await self.update(bump_on_thread_message=value)
+
+    # Write this space's current state through to the space index
+    def to_index(self):
+        cache.spaces.put(
+            self.guild_id,
+            self.space_id,
+            (self.owner_id, self.bump_on_message, self.bump_on_thread_message),
+        )
 
     async def check_exists(self, ctx, should_exist):
         if self.exists:
@@ -363,34 +394,34 @@ class Space:
 
 
 class Owner:
+    __slots__ = ("guild_id", "owner_id", "spaces", "space_count", "exists")
+
     def __init__(self):
         self.guild_id = None
         self.owner_id = None
         self.spaces = []
+        self.space_count = 0
         self.exists = False
 
+    @metrics.query
     async def async_init(self, guild_id, owner_id):
         self.guild_id = guild_id
         self.owner_id = owner_id
-        async with aiosqlite.connect("data/database.db") as db:
-            async with db.execute(
-                "SELECT * FROM spaces WHERE guild_id = ? AND owner_id = ?",
-                (guild_id, owner_id),
-            ) as cursor:
-                rows = await cursor.fetchall()
-                if rows:
-                    for row in rows:
-                        self.spaces.append(
-                            {
-                                "space_id": row[0],
-                                "bump_on_message": row[3],
-                                "bump_on_thread_message": row[4],
-                            }
-                        )
-                    self.exists = True
+        self.spaces = await storage.get_spaces(guild_id, owner_id=owner_id)
+        if self.spaces:
+            self.space_count = len(self.spaces)
+            self.exists = True
+
+    # Count the owner's spaces without loading them
+    @metrics.query
+    async def async_count(self, guild_id, owner_id):
+        self.guild_id = guild_id
+        self.owner_id = owner_id
+        self.space_count = await storage.count_spaces(guild_id, owner_id)
+        self.exists = self.space_count > 0
 
     async def check_max_spaces(self, ctx, max_spaces_per_owner):
-        if len(self.spaces) < max_spaces_per_owner:
+        if self.space_count < max_spaces_per_owner:
             return True
         else:
             await ctx.send_followup(
@@ -0,0 +1,77 @@
+import asyncio
+
+from loguru import logger
+
+from stuff import cache, db
+from stuff.config import HYGIENE_FLUSH_INTERVAL
+
+
+# Batches space pruning and guild and owner flags coming from gateway events
+class SpaceHygiene:
+    def __init__(self, interval):
+        self.interval = interval
+        self.space_ids = set()
+        self.guilds = {}
+        self.owners = {}
+        self.task = None
+
+    def space_deleted(self, guild_id, space_id):
+        cache.spaces.remove(guild_id, [space_id])
+        self.space_ids.add(space_id)
+        self.schedule()
+
+    # Spaces of a removed guild are kept, so a re-invite finds them, until
+    # db.purge_guilds deletes them after the grace period
+    def guild_removed(self, guild_id, removed_at):
+        self.guilds[guild_id] = removed_at
+        self.schedule()
+
+    def guild_returned(self, guild_id):
+        self.guilds[guild_id] = None
+        self.schedule()
+
+    def owner_left(self, guild_id, owner_id, left_at):
+        self.owners[(guild_id, owner_id)] = left_at
+        self.schedule()
+
+    def owner_returned(self, guild_id, owner_id):
+        self.owners[(guild_id, owner_id)] = None
+        self.schedule()
+
+    def schedule(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.interval)
+        self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            # flush kept the batch, so try it again next interval
+            logger.exception("Failed to prune spaces, retrying.")
+            self.schedule()
+
+    async def flush(self):
+        if not (self.space_ids or self.guilds or self.owners):
+            return
+        space_ids, self.space_ids = self.space_ids, set()
+        guilds, self.guilds = self.guilds, {}
+        owners, self.owners = self.owners, {}
+        try:
+            await db.prune_spaces(space_ids, guilds, owners)
+        except Exception:
+            # The space index already reflects these, so keep them for the next
+            # flush; flags set meanwhile are newer
+            self.space_ids |= space_ids
+            self.guilds = {**guilds, **self.guilds}
+            self.owners = {**owners, **self.owners}
+            raise
+        logger.info(
+            f"Pruned {len(space_ids)} spaces, updated {len(guilds)} guild and "
+            f"{len(owners)} owner flags."
+        )
+        await db.purge_guilds()
+
+
+hygiene = SpaceHygiene(HYGIENE_FLUSH_INTERVAL)
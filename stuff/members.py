@@ -0,0 +1,74 @@
+import asyncio
+
+import discord
+from loguru import logger
+
+from stuff import db
+
+# Member ids per gateway member query
+QUERY_LIMIT = 100
+
+# Background owner lookups, kept so they aren't collected mid-run
+tasks = set()
+
+
+# Client options for the memory mode. Low memory drops presences and startup
+# chunking, so the member cache only holds joiners, voice members, people who
+# used a command and the space owners cached by cache_owners.
+def client_options(low_memory):
+    intents = discord.Intents.all()
+    if not low_memory:
+        return {"intents": intents}
+    intents.presences = False
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": False,
+    }
+
+
+# Members by id, fetching those missing from a partial member cache over the
+# gateway. Ids that are not in the guild are left out.
+async def resolve(guild, member_ids):
+    members = {}
+    missing = []
+    for member_id in member_ids:
+        member = guild.get_member(member_id)
+        if member is None:
+            missing.append(member_id)
+        else:
+            members[member_id] = member
+
+    if missing and not guild.chunked:
+        for i in range(0, len(missing), QUERY_LIMIT):
+            for member in await guild.query_members(
+                user_ids=missing[i : i + QUERY_LIMIT], limit=QUERY_LIMIT, cache=True
+            ):
+                members[member.id] = member
+    return members
+
+
+# Keep space owners cached so their removals still reach on_member_remove
+async def cache_owners(guilds):
+    for guild in guilds:
+        try:
+            owners = await resolve(guild, await db.get_owner_ids(guild.id))
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out caching space owners of guild {guild.id}.")
+            continue
+        logger.debug(f"Cached {len(owners)} space owners of guild {guild.id}.")
+
+
+# Cache a new owner in the background
+def remember(guild, member_id):
+    if guild.get_member(member_id) is None and not guild.chunked:
+        task = asyncio.create_task(cache_owner(guild, member_id))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+
+async def cache_owner(guild, member_id):
+    try:
+        await resolve(guild, [member_id])
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out caching space owner {member_id}.")
@@ -0,0 +1,247 @@
+import asyncio
+import contextlib
+import functools
+import time
+
+from aiohttp import web
+from loguru import logger
+
+from stuff import cache, mutations
+
+# Latency histogram bucket bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    "bfcp_command_seconds": "Slash command latency",
+    "bfcp_command_errors_total": "Slash commands that raised",
+    "bfcp_listener_seconds": "Event listener latency",
+    "bfcp_listener_errors_total": "Event listeners that raised",
+    "bfcp_db_seconds": "Database call latency",
+    "bfcp_db_errors_total": "Database calls that raised",
+    "bfcp_loop_lag_seconds": "How late the event loop woke a sleeping task",
+}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+# Counters, latency histograms and scrape-time gauges, served as Prometheus
+# text. Recording is a no-op until the endpoint is started.
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.runner = None
+        self.lag_task = None
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(labels.items()))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    # collect() returns a value, or a list of (labels dict, value)
+    def gauge(self, name, help, collect, type="gauge"):
+        self.gauges[name] = (help, type, collect)
+
+    # Time a block into name's histogram, counting name's errors if it raises
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(name.replace("_seconds", "_errors_total"), labels)
+            raise
+        finally:
+            self.observe(name, labels, time.perf_counter() - start)
+
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in self.histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, series in sorted(by_name.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    bucket = format_labels(labels + (("le", bound),))
+                    lines.append(f"{name}_bucket{bucket} {cumulative}")
+                bucket = format_labels(labels + (("le", "+Inf"),))
+                lines.append(f"{name}_bucket{bucket} {histogram.count}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+        by_name = {}
+        for (name, labels), value in self.counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name, series in sorted(by_name.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+
+        for name, (help, type, collect) in sorted(self.gauges.items()):
+            try:
+                value = collect()
+            except Exception as e:
+                logger.warning(f"Failed to collect metric {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            if not isinstance(value, list):
+                value = [({}, value)]
+            for labels, sample in value:
+                lines.append(f"{name}{format_labels(tuple(labels.items()))} {sample}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain")
+
+    # Sleep in a loop and record how much later than asked each wakeup was
+    async def watch_loop(self, interval):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe(
+                "bfcp_loop_lag_seconds", {}, time.perf_counter() - start - interval
+            )
+
+    async def start(self, host, port, lag_interval=0.5):
+        if self.runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.lag_task = asyncio.create_task(self.watch_loop(lag_interval))
+        self.enabled = True
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics.")
+
+    async def stop(self):
+        self.enabled = False
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            self.lag_task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+registry = Registry()
+
+
+# Time a cog or bot event listener. Not labelled by guild, since that would
+# make the series count grow with the guild count.
+def listener(func):
+    @functools.wraps(func)
+    async def wrapper(*args):
+        if not registry.enabled:
+            return await func(*args)
+        with registry.timer("bfcp_listener_seconds", listener=func.__qualname__):
+            return await func(*args)
+
+    return wrapper
+
+
+# Time a database call
+def query(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not registry.enabled:
+            return await func(*args, **kwargs)
+        with registry.timer("bfcp_db_seconds", query=func.__qualname__):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+# Gauges for process-wide state: caches, the mutation queue and the gateway
+def register_defaults(bot):
+    # Commands handle their own errors, so count them from the error event.
+    # Any listener here turns off pycord's default handler, so log what it
+    # would have printed.
+    async def on_application_command_error(ctx, error):
+        if registry.enabled:
+            registry.inc(
+                "bfcp_command_errors_total", {"command": ctx.command.qualified_name}
+            )
+        if ctx.command and ctx.command.has_error_handler():
+            return
+        if ctx.cog and ctx.cog.has_error_handler():
+            return
+        logger.opt(exception=error).error(
+            f"Ignoring exception in command {ctx.command}:"
+        )
+
+    bot.add_listener(on_application_command_error)
+
+    def cache_stats(key):
+        return lambda: [
+            ({"cache": name}, stats()[key])
+            for name, stats in (
+                ("guilds", cache.guilds.stats),
+                ("spaces", cache.spaces.stats),
+            )
+        ]
+
+    registry.gauge("bfcp_cache_hit_ratio", "Cache hit ratio", cache_stats("hit_rate"))
+    registry.gauge("bfcp_cache_entries", "Cached entries", cache_stats("entries"))
+    registry.gauge(
+        "bfcp_gateway_latency_seconds", "Gateway heartbeat latency", lambda: bot.latency
+    )
+    registry.gauge(
+        "bfcp_mutation_queue_depth",
+        "Queued Discord mutations per guild",
+        lambda: [
+            ({"guild": guild_id}, depth)
+            for guild_id, depth in mutations.queue.stats()["depth_by_guild"].items()
+        ],
+    )
+    registry.gauge(
+        "bfcp_mutations_total",
+        "Discord mutations by outcome",
+        lambda: [
+            ({"state": state}, mutations.queue.stats()[state])
+            for state in ("submitted", "merged", "executed", "failed")
+        ],
+        type="counter",
+    )
+    registry.gauge(
+        "bfcp_mutation_wait_seconds_max",
+        "Longest time a mutation waited in the queue",
+        lambda: mutations.queue.stats()["wait_max"],
+    )
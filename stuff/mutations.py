@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+import discord
+from loguru import logger
+
+# Priority classes, lowest runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+
+# Budget per guild and bucket: (requests, per seconds)
+BUCKETS = {
+    "positions": (2, 10.0),
+    "channels": (5, 10.0),
+    "roles": (10, 10.0),
+    "messages": (5, 5.0),
+}
+
+
+class Job:
+    def __init__(self, key, run, priority, bucket, seq):
+        self.key = key
+        self.run = run
+        self.priority = priority
+        self.bucket = bucket
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+# Token bucket refilled continuously up to its capacity
+class Budget:
+    def __init__(self, capacity, per):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def take(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def drain(self):
+        self.tokens = 0
+        self.updated = time.monotonic()
+
+
+# Per-guild priority queue for outbound Discord mutations. Jobs with the same
+# key that have not started yet are merged: the latest run callable wins, the
+# job keeps the most urgent priority and every submitter gets its result. Keys
+# name the operation and its arguments, so only identical operations merge.
+class MutationQueue:
+    def __init__(self, buckets, retries=3):
+        self.buckets = buckets
+        self.retries = retries
+        self.heaps = {}
+        self.jobs = {}
+        self.workers = {}
+        self.budgets = {}
+        self.seq = itertools.count()
+        self.submitted = 0
+        self.merged = 0
+        self.executed = 0
+        self.failed = 0
+        self.attempts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # Queue run() for a guild; key None never merges. Await the result to
+    # wait for the job, or ignore it to fire and forget.
+    def submit(self, guild_id, key, run, priority=BACKGROUND, bucket="channels"):
+        self.submitted += 1
+        job = self.jobs.get((guild_id, key)) if key is not None else None
+        if job is not None:
+            self.merged += 1
+            job.run = run
+            if priority < job.priority:
+                job.priority = priority
+                job.seq = next(self.seq)
+                heapq.heappush(self.heaps[guild_id], (priority, job.seq, job))
+            return job.future
+
+        job = Job(key, run, priority, bucket, next(self.seq))
+        if key is not None:
+            self.jobs[(guild_id, key)] = job
+        heapq.heappush(self.heaps.setdefault(guild_id, []), (priority, job.seq, job))
+        if guild_id not in self.workers:
+            self.workers[guild_id] = asyncio.create_task(self.work(guild_id))
+        return job.future
+
+    async def work(self, guild_id):
+        heap = self.heaps[guild_id]
+        try:
+            while heap:
+                _, seq, job = heapq.heappop(heap)
+                # Superseded by a re-prioritised entry for the same job
+                if seq != job.seq:
+                    continue
+                if job.key is not None:
+                    self.jobs.pop((guild_id, job.key), None)
+                try:
+                    await self.execute(guild_id, job)
+                except asyncio.CancelledError:
+                    # Don't leave submitters waiting or later submits merging
+                    # into a job that will never run
+                    job.future.cancel()
+                    if self.jobs.get((guild_id, job.key)) is job:
+                        del self.jobs[(guild_id, job.key)]
+                    raise
+        finally:
+            self.workers.pop(guild_id, None)
+            if not heap:
+                self.heaps.pop(guild_id, None)
+
+    async def execute(self, guild_id, job):
+        budget = self.budgets.get((guild_id, job.bucket))
+        if budget is None:
+            budget = self.budgets[(guild_id, job.bucket)] = Budget(
+                *self.buckets[job.bucket]
+            )
+        await budget.take()
+
+        wait = time.monotonic() - job.enqueued_at
+        self.attempts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        job.attempts += 1
+        try:
+            result = await job.run()
+        except discord.HTTPException as e:
+            if e.status == 429 and job.attempts < self.retries:
+                logger.warning(f"Rate limited on {job.bucket} in guild {guild_id}.")
+                budget.drain()
+                if job.key is not None:
+                    self.jobs.setdefault((guild_id, job.key), job)
+                job.seq = next(self.seq)
+                heapq.heappush(self.heaps[guild_id], (job.priority, job.seq, job))
+                return
+            self.fail(job, e)
+        except Exception as e:
+            self.fail(job, e)
+        else:
+            self.executed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def fail(self, job, e):
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(e)
+        # Nobody may be awaiting a fire-and-forget job
+        job.future.add_done_callback(lambda future: future.exception())
+
+    # Stop the workers and cancel every job still queued, so nobody awaiting
+    # one hangs
+    def cancel(self):
+        for worker in self.workers.values():
+            worker.cancel()
+        for heap in self.heaps.values():
+            for _, _, job in heap:
+                job.future.cancel()
+        self.heaps.clear()
+        self.jobs.clear()
+
+    def stats(self):
+        # Entries superseded by a re-prioritised one aren't jobs of their own
+        depths = {
+            guild_id: sum(1 for _, seq, job in heap if seq == job.seq)
+            for guild_id, heap in self.heaps.items()
+        }
+        return {
+            "depth": sum(depths.values()),
+            "depth_by_guild": depths,
+            "submitted": self.submitted,
+            "merged": self.merged,
+            "executed": self.executed,
+            "failed": self.failed,
+            "wait_avg": self.wait_total / self.attempts if self.attempts else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+queue = MutationQueue(BUCKETS)
@@ -0,0 +1,109 @@
+import asyncio
+import contextlib
+
+import aiosqlite
+from loguru import logger
+
+# Per-connection settings by name. All use WAL; they trade how much a power
+# loss can take back against how often commits wait on fsync, and how much
+# memory reads may use. "fast" can lose recent commits, and with them a
+# setting change or a new space, if the machine goes down.
+PROFILES = {
+    "durable": {
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+    },
+    "balanced": {
+        "synchronous": "NORMAL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,
+    },
+    "fast": {
+        "synchronous": "OFF",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+    },
+}
+
+
+# Long-lived SQLite connections: a small pool of readers and one serialized
+# writer. The database runs in WAL mode, so several processes (one per shard
+# group) can share it: readers never block the writer, and writers wait up to
+# busy_timeout seconds for each other instead of failing.
+class Pool:
+    def __init__(self, path, readers=4, busy_timeout=5.0, profile="balanced"):
+        self.path = path
+        self.size = readers
+        self.busy_timeout = busy_timeout
+        self.profile = profile
+        self.pragmas = PROFILES[profile]
+        self.readers = asyncio.Queue()
+        self.writer = None
+        self.write_lock = asyncio.Lock()
+        self.open_lock = asyncio.Lock()
+        self.opened = False
+
+    async def open(self):
+        async with self.open_lock:
+            if self.opened:
+                return
+            # Writes take the lock up front, since a deferred transaction that
+            # has to upgrade from read to write can't wait on a busy database
+            self.writer = await aiosqlite.connect(
+                self.path, timeout=self.busy_timeout, isolation_level="IMMEDIATE"
+            )
+            await self.writer.execute("PRAGMA journal_mode = WAL")
+            await self.configure(self.writer)
+            for _ in range(self.size):
+                reader = await aiosqlite.connect(self.path, timeout=self.busy_timeout)
+                await self.configure(reader)
+                self.readers.put_nowait(reader)
+            self.opened = True
+            logger.info(
+                f"Opened {self.path} with {self.size} readers "
+                f"and the {self.profile} profile."
+            )
+
+    # Apply the profile; these settings last for the connection only
+    async def configure(self, db):
+        await db.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        for pragma, value in self.pragmas.items():
+            await db.execute(f"PRAGMA {pragma} = {value}")
+
+    async def close(self):
+        async with self.open_lock:
+            if not self.opened:
+                return
+            async with self.write_lock:
+                await self.writer.close()
+                self.writer = None
+            for _ in range(self.size):
+                await (await self.readers.get()).close()
+            self.opened = False
+
+    # Borrow a reader connection
+    @contextlib.asynccontextmanager
+    async def read(self):
+        if not self.opened:
+            await self.open()
+        db = await self.readers.get()
+        try:
+            yield db
+        finally:
+            self.readers.put_nowait(db)
+
+    # Hold the writer connection, committing on success and rolling back on error
+    @contextlib.asynccontextmanager
+    async def write(self):
+        if not self.opened:
+            await self.open()
+        async with self.write_lock:
+            try:
+                yield self.writer
+            except BaseException:
+                await self.writer.rollback()
+                raise
+            else:
+                await self.writer.commit()
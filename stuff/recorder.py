@@ -0,0 +1,112 @@
+import gzip
+import json
+import time
+
+import discord
+from loguru import logger
+
+from stuff import cache
+
+RECORDED_CHANNEL_TYPES = (discord.ChannelType.text, discord.ChannelType.public_thread)
+
+
+# Appends the gateway events the cogs react to to a gzipped JSONL file, keeping
+# only ids, timestamps and flags so recordings carry no content or names
+class GatewayRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.recorded = 0
+
+    def attach(self, bot):
+        self.file = gzip.open(self.path, "at", encoding="utf-8")
+        for listener in (
+            self.on_message,
+            self.on_member_update,
+            self.on_guild_channel_create,
+            self.on_guild_channel_delete,
+        ):
+            bot.add_listener(listener)
+        logger.info(f"Recording gateway events to {self.path}.")
+
+    def write(self, event, **fields):
+        if self.file is None:
+            return
+        self.file.write(
+            json.dumps({"time": time.time(), "event": event, **fields}) + "\n"
+        )
+        self.recorded += 1
+
+    # Guild layout and configuration, so a replay starts from the same state
+    def snapshot(self, guilds):
+        for guild in guilds:
+            config = cache.guilds.get(guild.id) or {}
+            spaces = cache.spaces.spaces(guild.id)
+            self.write(
+                "snapshot",
+                guild_id=guild.id,
+                space_category_id=config.get("space_category_id"),
+                pinned_channel_ids=list(config.get("pinned_channel_ids", ())),
+                greet_channel_id=config.get("greet_channel_id"),
+                greet_attachments=len(config.get("greet_attachments", ())),
+                categories=[category.id for category in guild.categories],
+                channels=[
+                    [channel.id, channel.category_id, channel.position]
+                    for channel in guild.text_channels
+                ],
+                spaces=[[space_id, *entry] for space_id, entry in spaces.items()],
+            )
+
+    async def on_message(self, message):
+        channel = message.channel
+        if message.guild is None or channel.type not in RECORDED_CHANNEL_TYPES:
+            return
+        thread = channel.type == discord.ChannelType.public_thread
+        self.write(
+            "message",
+            guild_id=message.guild.id,
+            channel_id=channel.id,
+            parent_id=channel.parent_id if thread else None,
+            author_id=message.author.id,
+            message_id=message.id,
+        )
+
+    async def on_member_update(self, before, after):
+        self.write(
+            "member_update",
+            guild_id=after.guild.id,
+            member_id=after.id,
+            before_pending=before.pending,
+            after_pending=after.pending,
+        )
+
+    async def on_guild_channel_create(self, channel):
+        if not isinstance(channel, (discord.TextChannel, discord.CategoryChannel)):
+            return
+        self.write(
+            "channel_create",
+            guild_id=channel.guild.id,
+            channel_id=channel.id,
+            category_id=channel.category_id,
+            position=channel.position,
+            category=isinstance(channel, discord.CategoryChannel),
+        )
+
+    async def on_guild_channel_delete(self, channel):
+        self.write("channel_delete", guild_id=channel.guild.id, channel_id=channel.id)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            logger.info(f"Recorded {self.recorded} gateway events.")
+
+
+# Read a recording back, stopping cleanly at a truncated tail
+def read(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                yield json.loads(line)
+        except (EOFError, json.JSONDecodeError):
+            logger.warning(f"Recording {path} ends with a truncated event.")
@@ -0,0 +1,39 @@
+from bisect import bisect_left
+
+
+# Indices of one longest strictly increasing subsequence of values
+def longest_increasing_subsequence(values):
+    tails = []
+    tail_indices = []
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        j = bisect_left(tails, value)
+        if j == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[j] = value
+            tail_indices[j] = i
+        previous[i] = tail_indices[j - 1] if j else None
+
+    indices = []
+    i = tail_indices[-1] if tail_indices else None
+    while i is not None:
+        indices.append(i)
+        i = previous[i]
+    return indices[::-1]
+
+
+# Fewest single-item moves that turn current into target, as (id, after_id) pairs
+# applied in order, where after_id None means the front
+def plan_moves(current, target):
+    rank = {id: i for i, id in enumerate(target)}
+    present = [id for id in current if id in rank]
+    kept = {
+        present[i] for i in longest_increasing_subsequence([rank[id] for id in present])
+    }
+    return [
+        (id, target[i - 1] if i else None)
+        for i, id in enumerate(target)
+        if id not in kept
+    ]
@@ -0,0 +1,66 @@
+import asyncio
+import functools
+import time
+
+import discord
+from loguru import logger
+
+from stuff import mutations
+
+
+# Applies role changes to many members through the mutation queue, which paces
+# them, recording failures instead of stopping at the first one
+class RolePropagation:
+    def __init__(self, progress=None, progress_interval=5.0):
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.total = 0
+        self.done = 0
+        self.changed = 0
+        self.failed = []
+        self.last_progress = 0.0
+
+    # changes: (member, roles to add, roles to remove)
+    async def run(self, changes):
+        self.total = len(changes)
+
+        async def apply(member, add, remove):
+            await self.apply(member, add, remove)
+            self.done += 1
+            await self.report()
+
+        await asyncio.gather(*(apply(*change) for change in changes))
+        return self
+
+    # One queued job per HTTP call, so each takes its own token from the roles
+    # budget. Members are queued together and the queue paces them.
+    async def apply(self, member, add, remove):
+        try:
+            if remove:
+                await self.submit(member, "remove_roles", member.remove_roles, remove)
+            if add:
+                await self.submit(member, "add_roles", member.add_roles, add)
+            self.changed += 1
+        except discord.HTTPException as e:
+            self.failed.append((member, e))
+
+    def submit(self, member, operation, run, roles):
+        return mutations.queue.submit(
+            member.guild.id,
+            (operation, member.id, tuple(role.id for role in roles)),
+            functools.partial(run, *roles),
+            mutations.BULK,
+            "roles",
+        )
+
+    async def report(self):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if self.done < self.total and now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        try:
+            await self.progress(self)
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to report role propagation progress: {e}")
@@ -0,0 +1,483 @@
+import contextlib
+import contextvars
+import json
+
+from loguru import logger
+
+from stuff import cache
+from stuff.storage import (
+    GuildRow,
+    SpaceRow,
+    Storage,
+    default_guild,
+    row_factory,
+)
+
+# Child table and value column for each guild list setting
+LIST_TABLES = {
+    "greet_attachments": ("guild_greet_attachments", "url"),
+    "pinned_channel_ids": ("guild_pinned_channels", "channel_id"),
+    "whitelisted_role_ids": ("guild_whitelisted_roles", "role_id"),
+}
+
+GUILD_ROWS = row_factory(GuildRow)
+SPACE_ROWS = row_factory(SpaceRow)
+
+# Bound parameters per IN (...) list, under SQLite's default limit
+CHUNK = 500
+
+# Writer connection of the batch the current task is applying, if any
+batch = contextvars.ContextVar("batch", default=None)
+
+
+# Schema version 1: the original tables
+async def create_tables(db):
+    await db.execute("""
+            CREATE TABLE IF NOT EXISTS spaces (
+                space_id INTEGER PRIMARY KEY,
+                guild_id INTEGER,
+                owner_id INTEGER,
+                bump_on_message INTEGER,
+                bump_on_thread_message INTEGER
+            );
+        """)
+    await db.execute("""
+            CREATE TABLE IF NOT EXISTS guilds (
+                guild_id INTEGER PRIMARY KEY,
+                greet_channel_id INTEGER,
+                greet_message TEXT,
+                greet_attachments TEXT,
+                space_category_id INTEGER,
+                space_owner_role_id INTEGER,
+                max_spaces_per_owner INTEGER,
+                pinned_channel_ids TEXT,
+                whitelisted_role_ids TEXT,
+                bump_on_message INTEGER,
+                bump_on_thread_message INTEGER
+            );
+        """)
+
+
+# Schema version 2: space activity ledger
+async def create_activity(db):
+    await db.execute("""
+            CREATE TABLE IF NOT EXISTS activity (
+                space_id INTEGER PRIMARY KEY,
+                guild_id INTEGER,
+                last_active REAL
+            );
+        """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS activity_guild_id ON activity (guild_id)"
+    )
+
+
+# Schema version 3: move the JSON-encoded guild lists into child tables
+async def normalize_guild_lists(db):
+    for attribute, (table, column) in LIST_TABLES.items():
+        await db.execute(f"""
+                CREATE TABLE {table} (
+                    guild_id INTEGER,
+                    {column} {"TEXT" if column == "url" else "INTEGER"},
+                    PRIMARY KEY (guild_id, {column})
+                );
+            """)
+        async with db.execute(f"SELECT guild_id, {attribute} FROM guilds") as cursor:
+            rows = await cursor.fetchall()
+        await db.executemany(
+            f"INSERT OR IGNORE INTO {table} VALUES (?, ?)",
+            [
+                (guild_id, value)
+                for guild_id, values in rows
+                for value in json.loads(values or "[]")
+            ],
+        )
+
+    # Rebuild rather than DROP COLUMN, which needs SQLite 3.35
+    await db.execute("""
+            CREATE TABLE guilds_new (
+                guild_id INTEGER PRIMARY KEY,
+                greet_channel_id INTEGER,
+                greet_message TEXT,
+                space_category_id INTEGER,
+                space_owner_role_id INTEGER,
+                max_spaces_per_owner INTEGER,
+                bump_on_message INTEGER,
+                bump_on_thread_message INTEGER
+            );
+        """)
+    await db.execute("""
+            INSERT INTO guilds_new
+            SELECT guild_id, greet_channel_id, greet_message, space_category_id,
+                space_owner_role_id, max_spaces_per_owner, bump_on_message,
+                bump_on_thread_message
+            FROM guilds
+        """)
+    await db.execute("DROP TABLE guilds")
+    await db.execute("ALTER TABLE guilds_new RENAME TO guilds")
+
+
+# Schema version 4: composite indexes for owner and per-guild space lookups
+async def index_spaces(db):
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS spaces_guild_id_owner_id ON spaces (guild_id, owner_id)"
+    )
+
+
+# Schema version 5: flag spaces whose owner left the guild
+async def add_owner_left_at(db):
+    await db.execute("ALTER TABLE spaces ADD COLUMN owner_left_at REAL")
+
+
+# Schema version 6: flag guilds the bot was removed from
+async def add_removed_at(db):
+    await db.execute("ALTER TABLE guilds ADD COLUMN removed_at REAL")
+
+
+# Applied in order; the database's user_version counts how many have run
+MIGRATIONS = [
+    create_tables,
+    create_activity,
+    normalize_guild_lists,
+    index_spaces,
+    add_owner_left_at,
+    add_removed_at,
+]
+
+
+# SQL condition and parameters matching guilds on the given shards
+def shard_filter(shard_ids):
+    placeholders = ", ".join("?" * len(shard_ids))
+    return f"(guild_id >> 22) % ? IN ({placeholders})", (
+        cache.shard_count,
+        *shard_ids,
+    )
+
+
+# Run a SELECT of a row type's fields and return its rows as that type
+async def fetch(db, factory, query, params=()):
+    async with db.execute(query, params) as cursor:
+        cursor.row_factory = factory
+        return await cursor.fetchall()
+
+
+def chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), CHUNK):
+        yield ids[i : i + CHUNK]
+
+
+# The bot's SQLite database behind a connection pool
+class SQLiteStorage(Storage):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def open(self):
+        await self.pool.open()
+
+    async def close(self):
+        await self.pool.close()
+
+    # The writer, inside the current batch's transaction if there is one
+    @contextlib.asynccontextmanager
+    async def write(self):
+        db = batch.get()
+        if db is not None:
+            yield db
+            return
+        async with self.pool.write() as db:
+            yield db
+
+    async def apply(self, operations):
+        async with self.pool.write() as db:
+            token = batch.set(db)
+            try:
+                for name, args in operations:
+                    await getattr(self, name)(*args)
+            finally:
+                batch.reset(token)
+
+    # Upgrade the database in place to the latest schema
+    async def initialize(self):
+        async with self.write() as db:
+            # Take the write lock before reading the version, so processes
+            # sharing the database can't both run the same migrations
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute("PRAGMA user_version") as cursor:
+                (version,) = await cursor.fetchone()
+            if version >= len(MIGRATIONS):
+                return
+
+            for version, migration in enumerate(MIGRATIONS[version:], version + 1):
+                await migration(db)
+                await db.execute(f"PRAGMA user_version = {version}")
+                logger.info(f"Migrated database to schema version {version}.")
+
+    async def add_guilds(self, guild_ids):
+        async with self.write() as db:
+            await db.executemany(
+                "UPDATE guilds SET removed_at = NULL WHERE guild_id = ? AND removed_at IS NOT NULL",
+                [(guild_id,) for guild_id in guild_ids],
+            )
+            changes = db.total_changes
+            await db.executemany(
+                f"INSERT OR IGNORE INTO guilds ({', '.join(GuildRow._fields)}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [default_guild(guild_id) for guild_id in guild_ids],
+            )
+            return db.total_changes - changes
+
+    async def get_guilds(self, guild_ids=None, shard_ids=None):
+        async with self.pool.read() as db:
+            if guild_ids is None:
+                condition, params = "1", ()
+                if shard_ids is not None:
+                    condition, params = shard_filter(shard_ids)
+                return await self.select_guilds(db, condition, params)
+
+            guilds = []
+            for chunk in chunks(guild_ids):
+                condition = f"guild_id IN ({', '.join('?' * len(chunk))})"
+                guilds += await self.select_guilds(db, condition, chunk)
+            return guilds
+
+    async def select_guilds(self, db, condition, params):
+        lists = {}
+        for attribute, (table, column) in LIST_TABLES.items():
+            async with db.execute(
+                f"SELECT guild_id, {column} FROM {table} WHERE {condition} ORDER BY rowid",
+                params,
+            ) as cursor:
+                async for guild_id, value in cursor:
+                    lists.setdefault(guild_id, {}).setdefault(attribute, []).append(
+                        value
+                    )
+        rows = await fetch(
+            db,
+            GUILD_ROWS,
+            f"SELECT {', '.join(GuildRow._fields)} FROM guilds WHERE {condition}",
+            params,
+        )
+        return [(row, lists.get(row.guild_id, {})) for row in rows]
+
+    async def update_guild(self, guild_id, values):
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        async with self.write() as db:
+            await db.execute(
+                f"UPDATE guilds SET {assignments} WHERE guild_id = ?",
+                (*values.values(), guild_id),
+            )
+
+    async def add_to_guild_list(self, guild_id, attribute, value):
+        table, _ = LIST_TABLES[attribute]
+        async with self.write() as db:
+            await db.execute(
+                f"INSERT OR IGNORE INTO {table} VALUES (?, ?)", (guild_id, value)
+            )
+
+    async def remove_from_guild_list(self, guild_id, attribute, value):
+        table, column = LIST_TABLES[attribute]
+        async with self.write() as db:
+            await db.execute(
+                f"DELETE FROM {table} WHERE guild_id = ? AND {column} = ?",
+                (guild_id, value),
+            )
+
+    async def get_spaces(
+        self, guild_id=None, space_ids=None, owner_id=None, shard_ids=None
+    ):
+        conditions, params = [], []
+        if guild_id is not None:
+            conditions.append("guild_id = ?")
+            params.append(guild_id)
+        if owner_id is not None:
+            conditions.append("owner_id = ?")
+            params.append(owner_id)
+        if shard_ids is not None:
+            condition, shard_params = shard_filter(shard_ids)
+            conditions.append(condition)
+            params += shard_params
+
+        query = (
+            f"SELECT {', '.join(SpaceRow._fields)} FROM spaces "
+            f"WHERE {' AND '.join(conditions) or '1'}"
+        )
+        async with self.pool.read() as db:
+            if space_ids is None:
+                return await fetch(db, SPACE_ROWS, query, params)
+
+            rows = []
+            for chunk in chunks(space_ids):
+                rows += await fetch(
+                    db,
+                    SPACE_ROWS,
+                    f"{query} AND space_id IN ({', '.join('?' * len(chunk))})",
+                    (*params, *chunk),
+                )
+            return rows
+
+    async def count_spaces(self, guild_id, owner_id):
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT COUNT(*) FROM spaces WHERE guild_id = ? AND owner_id = ?",
+                (guild_id, owner_id),
+            ) as cursor:
+                (count,) = await cursor.fetchone()
+                return count
+
+    async def get_owner_ids(self, guild_id):
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT DISTINCT owner_id FROM spaces WHERE guild_id = ?",
+                (guild_id,),
+            ) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+    async def upsert_spaces(self, rows):
+        async with self.write() as db:
+            await db.executemany(
+                f"INSERT OR REPLACE INTO spaces ({', '.join(SpaceRow._fields)}) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    async def update_spaces(self, updates):
+        # One statement per distinct set of fields
+        statements = {}
+        for space_id, values in updates:
+            statements.setdefault(tuple(values), []).append(
+                (*values.values(), space_id)
+            )
+        async with self.write() as db:
+            for fields, params in statements.items():
+                assignments = ", ".join(f"{field} = ?" for field in fields)
+                await db.executemany(
+                    f"UPDATE spaces SET {assignments} WHERE space_id = ?", params
+                )
+
+    async def prune_spaces(self, space_ids, guilds, owners):
+        async with self.write() as db:
+            for table in ("spaces", "activity"):
+                await db.executemany(
+                    f"DELETE FROM {table} WHERE space_id = ?",
+                    [(space_id,) for space_id in space_ids],
+                )
+            await db.executemany(
+                "UPDATE guilds SET removed_at = ? WHERE guild_id = ?",
+                [(removed_at, guild_id) for guild_id, removed_at in guilds.items()],
+            )
+            await db.executemany(
+                "UPDATE spaces SET owner_left_at = ? WHERE guild_id = ? AND owner_id = ?",
+                [
+                    (left_at, guild_id, owner_id)
+                    for (guild_id, owner_id), left_at in owners.items()
+                ],
+            )
+
+    async def purge_guilds(self, before):
+        async with self.write() as db:
+            async with db.execute(
+                "SELECT guild_id FROM guilds WHERE removed_at < ?", (before,)
+            ) as cursor:
+                guild_ids = [row[0] for row in await cursor.fetchall()]
+            for table in ("spaces", "activity"):
+                await db.executemany(
+                    f"DELETE FROM {table} WHERE guild_id = ?",
+                    [(guild_id,) for guild_id in guild_ids],
+                )
+            await db.executemany(
+                "UPDATE guilds SET removed_at = NULL WHERE guild_id = ?",
+                [(guild_id,) for guild_id in guild_ids],
+            )
+        return guild_ids
+
+    async def reconcile_spaces(
+        self, guild_id, channel_ids, member_ids, check_owners=True
+    ):
+        async with self.write() as db:
+            for table, ids in (
+                ("live_channels", channel_ids),
+                ("live_members", member_ids),
+            ):
+                await db.execute(
+                    f"CREATE TEMP TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY)"
+                )
+                await db.execute(f"DELETE FROM temp.{table}")
+                await db.executemany(
+                    f"INSERT OR IGNORE INTO temp.{table} VALUES (?)",
+                    [(id,) for id in ids or ()],
+                )
+
+            async with db.execute(
+                """
+                    SELECT space_id FROM spaces
+                    WHERE guild_id = ? AND space_id NOT IN (SELECT id FROM live_channels)
+                """,
+                (guild_id,),
+            ) as cursor:
+                space_ids = {row[0] for row in await cursor.fetchall()}
+
+            owner_rows = []
+            if check_owners and member_ids is not None:
+                # Membership is known, so a present owner's flag is stale
+                await db.execute(
+                    """
+                        UPDATE spaces SET owner_left_at = NULL
+                        WHERE guild_id = ? AND owner_left_at IS NOT NULL
+                        AND owner_id IN (SELECT id FROM live_members)
+                    """,
+                    (guild_id,),
+                )
+                async with db.execute(
+                    """
+                        SELECT space_id, owner_id FROM spaces
+                        WHERE guild_id = ?
+                        AND owner_id NOT IN (SELECT id FROM live_members)
+                    """,
+                    (guild_id,),
+                ) as cursor:
+                    owner_rows = await cursor.fetchall()
+            elif check_owners:
+                async with db.execute(
+                    """
+                        SELECT space_id, owner_id FROM spaces
+                        WHERE guild_id = ? AND owner_left_at IS NOT NULL
+                    """,
+                    (guild_id,),
+                ) as cursor:
+                    owner_rows = await cursor.fetchall()
+            owner_space_ids = {row[0] for row in owner_rows} - space_ids
+
+            await db.executemany(
+                "DELETE FROM spaces WHERE space_id = ?",
+                [(space_id,) for space_id in space_ids | owner_space_ids],
+            )
+            await db.execute(
+                """
+                    DELETE FROM activity
+                    WHERE guild_id = ? AND space_id NOT IN (SELECT space_id FROM spaces)
+                """,
+                (guild_id,),
+            )
+            await db.execute("DELETE FROM temp.live_channels")
+            await db.execute("DELETE FROM temp.live_members")
+        return space_ids, owner_space_ids, {row[1] for row in owner_rows}
+
+    async def record_activity(self, rows):
+        async with self.write() as db:
+            await db.executemany(
+                """
+                    INSERT INTO activity VALUES (?, ?, ?)
+                    ON CONFLICT (space_id) DO UPDATE
+                    SET last_active = MAX(last_active, excluded.last_active)
+                """,
+                rows,
+            )
+
+    async def get_activity(self, guild_id):
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT space_id, last_active FROM activity WHERE guild_id = ?",
+                (guild_id,),
+            ) as cursor:
+                return dict(await cursor.fetchall())
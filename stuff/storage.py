@@ -0,0 +1,306 @@
+import collections
+
+from stuff import cache
+
+# Guild settings in row order
+GUILD_COLUMNS = (
+    "guild_id",
+    "greet_channel_id",
+    "greet_message",
+    "space_category_id",
+    "space_owner_role_id",
+    "max_spaces_per_owner",
+    "bump_on_message",
+    "bump_on_thread_message",
+)
+
+# Guild attributes holding a list of values
+GUILD_LISTS = ("greet_attachments", "pinned_channel_ids", "whitelisted_role_ids")
+
+# Space fields in row order
+SPACE_FIELDS = (
+    "space_id",
+    "guild_id",
+    "owner_id",
+    "bump_on_message",
+    "bump_on_thread_message",
+)
+
+# Rows as every store returns them: plain tuples whose fields also have names
+GuildRow = collections.namedtuple("GuildRow", GUILD_COLUMNS)
+SpaceRow = collections.namedtuple("SpaceRow", SPACE_FIELDS)
+
+
+# sqlite3 row factory for a SELECT of a row type's fields, in order
+def row_factory(record):
+    def factory(cursor, row):
+        return record._make(row)
+
+    return factory
+
+
+# Settings for a newly registered guild
+def default_guild(guild_id):
+    return GuildRow(guild_id, None, "", None, None, 1, True, True)
+
+
+# What Guild, Space and Owner need from a store. Reads return GuildRow and
+# SpaceRow; batch methods take and return many rows so callers make one round
+# trip instead of one per row.
+class Storage:
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # Apply any writes still queued
+    async def flush(self):
+        pass
+
+    # Create the schema or bring it up to date
+    async def initialize(self):
+        raise NotImplementedError
+
+    # Register guilds with default settings, skipping known ones and clearing
+    # their removed flags; returns how many were added
+    async def add_guilds(self, guild_ids):
+        raise NotImplementedError
+
+    # (row, lists) per guild, for some guilds, some shards or all of them
+    async def get_guilds(self, guild_ids=None, shard_ids=None):
+        raise NotImplementedError
+
+    # values maps GUILD_COLUMNS names to new values
+    async def update_guild(self, guild_id, values):
+        raise NotImplementedError
+
+    async def add_to_guild_list(self, guild_id, attribute, value):
+        raise NotImplementedError
+
+    async def remove_from_guild_list(self, guild_id, attribute, value):
+        raise NotImplementedError
+
+    # Space rows matching every filter given
+    async def get_spaces(
+        self, guild_id=None, space_ids=None, owner_id=None, shard_ids=None
+    ):
+        raise NotImplementedError
+
+    async def count_spaces(self, guild_id, owner_id):
+        raise NotImplementedError
+
+    async def get_owner_ids(self, guild_id):
+        raise NotImplementedError
+
+    # Insert or replace spaces, clearing their departed-owner flags
+    async def upsert_spaces(self, rows):
+        raise NotImplementedError
+
+    # updates: (space_id, {field: value}); owner_left_at is a valid field
+    async def update_spaces(self, updates):
+        raise NotImplementedError
+
+    # Prune deleted spaces and flag removed guilds and departed owners; guilds
+    # maps guild_id to when the bot was removed, and owners maps (guild_id,
+    # owner_id) to when they left, or None when they came back
+    async def prune_spaces(self, space_ids, guilds, owners):
+        raise NotImplementedError
+
+    # Delete the spaces and activity of guilds flagged as removed before the
+    # given time, unflagging them; returns their ids
+    async def purge_guilds(self, before):
+        raise NotImplementedError
+
+    # Delete a guild's spaces whose channel is gone and, if check_owners, whose
+    # owner is not among member_ids, clearing present owners' departed flags.
+    # When member_ids is None, membership is unknown and the flags decide.
+    # Returns the deleted space ids, the ones deleted for their owner, and
+    # those owners.
+    async def reconcile_spaces(
+        self, guild_id, channel_ids, member_ids, check_owners=True
+    ):
+        raise NotImplementedError
+
+    # rows: (space_id, guild_id, timestamp), keeping the newest per space
+    async def record_activity(self, rows):
+        raise NotImplementedError
+
+    async def get_activity(self, guild_id):
+        raise NotImplementedError
+
+    # Run (method name, args) write operations in order, atomically where the
+    # store supports it
+    async def apply(self, operations):
+        for name, args in operations:
+            await getattr(self, name)(*args)
+
+
+# Everything in dicts, for tests and benchmarks
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.guilds = {}
+        self.lists = {}
+        self.spaces = {}
+        self.owner_left_at = {}
+        self.removed_at = {}
+        self.activity = {}
+
+    async def initialize(self):
+        pass
+
+    async def add_guilds(self, guild_ids):
+        added = 0
+        for guild_id in guild_ids:
+            self.removed_at.pop(guild_id, None)
+            if guild_id not in self.guilds:
+                self.guilds[guild_id] = default_guild(guild_id)
+                added += 1
+        return added
+
+    async def get_guilds(self, guild_ids=None, shard_ids=None):
+        if guild_ids is None:
+            guild_ids = list(self.guilds)
+        return [
+            (self.guilds[guild_id], self.copy_lists(guild_id))
+            for guild_id in guild_ids
+            if guild_id in self.guilds
+            and (shard_ids is None or cache.shard_of(guild_id) in shard_ids)
+        ]
+
+    def copy_lists(self, guild_id):
+        return {
+            attribute: list(values)
+            for attribute, values in self.lists.get(guild_id, {}).items()
+        }
+
+    async def update_guild(self, guild_id, values):
+        if guild_id in self.guilds:
+            self.guilds[guild_id] = self.guilds[guild_id]._replace(**values)
+
+    async def add_to_guild_list(self, guild_id, attribute, value):
+        values = self.lists.setdefault(guild_id, {}).setdefault(attribute, [])
+        if value not in values:
+            values.append(value)
+
+    async def remove_from_guild_list(self, guild_id, attribute, value):
+        values = self.lists.get(guild_id, {}).get(attribute, [])
+        if value in values:
+            values.remove(value)
+
+    async def get_spaces(
+        self, guild_id=None, space_ids=None, owner_id=None, shard_ids=None
+    ):
+        if space_ids is None:
+            rows = self.spaces.values()
+        else:
+            rows = (self.spaces[id] for id in space_ids if id in self.spaces)
+        return [
+            row
+            for row in rows
+            if (guild_id is None or row.guild_id == guild_id)
+            and (owner_id is None or row.owner_id == owner_id)
+            and (shard_ids is None or cache.shard_of(row.guild_id) in shard_ids)
+        ]
+
+    async def count_spaces(self, guild_id, owner_id):
+        return len(await self.get_spaces(guild_id, owner_id=owner_id))
+
+    async def get_owner_ids(self, guild_id):
+        return list({row.owner_id for row in await self.get_spaces(guild_id)})
+
+    async def upsert_spaces(self, rows):
+        for row in rows:
+            row = SpaceRow._make(row)
+            self.spaces[row.space_id] = row
+            self.owner_left_at.pop(row.space_id, None)
+
+    async def update_spaces(self, updates):
+        for space_id, values in updates:
+            if space_id not in self.spaces:
+                continue
+            values = dict(values)
+            if "owner_left_at" in values:
+                self.owner_left_at[space_id] = values.pop("owner_left_at")
+            self.spaces[space_id] = self.spaces[space_id]._replace(**values)
+
+    def delete_spaces(self, space_ids):
+        for space_id in space_ids:
+            self.spaces.pop(space_id, None)
+            self.owner_left_at.pop(space_id, None)
+            self.activity.pop(space_id, None)
+
+    async def prune_spaces(self, space_ids, guilds, owners):
+        self.delete_spaces(space_ids)
+        for guild_id, removed_at in guilds.items():
+            if guild_id not in self.guilds:
+                continue
+            if removed_at is None:
+                self.removed_at.pop(guild_id, None)
+            else:
+                self.removed_at[guild_id] = removed_at
+        for space_id, row in self.spaces.items():
+            if (row.guild_id, row.owner_id) in owners:
+                self.owner_left_at[space_id] = owners[(row.guild_id, row.owner_id)]
+
+    async def purge_guilds(self, before):
+        guild_ids = {
+            guild_id
+            for guild_id, removed_at in self.removed_at.items()
+            if removed_at < before
+        }
+        self.delete_spaces(
+            [
+                space_id
+                for space_id, row in self.spaces.items()
+                if row.guild_id in guild_ids
+            ]
+        )
+        self.activity = {
+            space_id: entry
+            for space_id, entry in self.activity.items()
+            if entry[0] not in guild_ids
+        }
+        for guild_id in guild_ids:
+            del self.removed_at[guild_id]
+        return list(guild_ids)
+
+    async def reconcile_spaces(
+        self, guild_id, channel_ids, member_ids, check_owners=True
+    ):
+        channel_ids = set(channel_ids)
+        rows = await self.get_spaces(guild_id)
+        space_ids = {row.space_id for row in rows if row.space_id not in channel_ids}
+        owner_rows = []
+        if check_owners and member_ids is not None:
+            member_ids = set(member_ids)
+            owner_rows = [row for row in rows if row.owner_id not in member_ids]
+            for row in rows:
+                if row.owner_id in member_ids:
+                    self.owner_left_at.pop(row.space_id, None)
+        elif check_owners:
+            owner_rows = [
+                row for row in rows if self.owner_left_at.get(row.space_id) is not None
+            ]
+        owner_space_ids = {row.space_id for row in owner_rows} - space_ids
+        self.delete_spaces(space_ids | owner_space_ids)
+        self.activity = {
+            space_id: entry
+            for space_id, entry in self.activity.items()
+            if entry[0] != guild_id or space_id in self.spaces
+        }
+        return space_ids, owner_space_ids, {row.owner_id for row in owner_rows}
+
+    async def record_activity(self, rows):
+        for space_id, guild_id, timestamp in rows:
+            current = self.activity.get(space_id)
+            if current is not None:
+                timestamp = max(timestamp, current[1])
+            self.activity[space_id] = (guild_id, timestamp)
+
+    async def get_activity(self, guild_id):
+        return {
+            space_id: timestamp
+            for space_id, (entry_guild_id, timestamp) in self.activity.items()
+            if entry_guild_id == guild_id
+        }
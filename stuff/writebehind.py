@@ -0,0 +1,136 @@
+import asyncio
+
+from loguru import logger
+
+from stuff.storage import Storage
+
+# Deferred writes whose rows can be merged into the previous call's
+BATCHED = ("upsert_spaces", "update_spaces", "record_activity")
+
+
+# Queues writes in front of another store and applies them in one transaction
+# every interval seconds or max_operations writes. Guild, Space and Owner
+# update the caches as they write, and every read here flushes first, so
+# readers still see their own writes.
+class WriteBehind(Storage):
+    def __init__(self, storage, interval, max_operations):
+        self.storage = storage
+        self.interval = interval
+        self.max_operations = max_operations
+        self.operations = []
+        self.count = 0
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    async def defer(self, name, *args):
+        if name in BATCHED:
+            if self.operations and self.operations[-1][0] == name:
+                self.operations[-1][1][0].extend(args[0])
+            else:
+                self.operations.append((name, (list(args[0]),)))
+        else:
+            self.operations.append((name, args))
+        self.count += 1
+
+        if self.count >= self.max_operations:
+            await self.flush()
+        elif self.task is None:
+            self.task = asyncio.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.interval)
+        self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            # flush kept the writes, so try them again next interval
+            logger.exception("Failed to flush deferred writes, retrying.")
+            if self.task is None:
+                self.task = asyncio.create_task(self.flush_later())
+
+    async def flush(self):
+        async with self.lock:
+            if not self.operations:
+                return
+            operations, self.operations = self.operations, []
+            count, self.count = self.count, 0
+            try:
+                await self.storage.apply(operations)
+            except Exception:
+                # Keep them for the next flush rather than losing them
+                self.operations = operations + self.operations
+                self.count += count
+                raise
+            logger.debug(f"Flushed {count} writes in {len(operations)} batches.")
+
+    async def open(self):
+        await self.storage.open()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+        await self.storage.close()
+
+    async def initialize(self):
+        await self.storage.initialize()
+
+    async def add_guilds(self, guild_ids):
+        await self.flush()
+        return await self.storage.add_guilds(guild_ids)
+
+    async def get_guilds(self, guild_ids=None, shard_ids=None):
+        await self.flush()
+        return await self.storage.get_guilds(guild_ids, shard_ids)
+
+    async def get_spaces(
+        self, guild_id=None, space_ids=None, owner_id=None, shard_ids=None
+    ):
+        await self.flush()
+        return await self.storage.get_spaces(guild_id, space_ids, owner_id, shard_ids)
+
+    async def count_spaces(self, guild_id, owner_id):
+        await self.flush()
+        return await self.storage.count_spaces(guild_id, owner_id)
+
+    async def get_owner_ids(self, guild_id):
+        await self.flush()
+        return await self.storage.get_owner_ids(guild_id)
+
+    async def purge_guilds(self, before):
+        await self.flush()
+        return await self.storage.purge_guilds(before)
+
+    async def reconcile_spaces(
+        self, guild_id, channel_ids, member_ids, check_owners=True
+    ):
+        await self.flush()
+        return await self.storage.reconcile_spaces(
+            guild_id, channel_ids, member_ids, check_owners
+        )
+
+    async def get_activity(self, guild_id):
+        await self.flush()
+        return await self.storage.get_activity(guild_id)
+
+    async def update_guild(self, guild_id, values):
+        await self.defer("update_guild", guild_id, values)
+
+    async def add_to_guild_list(self, guild_id, attribute, value):
+        await self.defer("add_to_guild_list", guild_id, attribute, value)
+
+    async def remove_from_guild_list(self, guild_id, attribute, value):
+        await self.defer("remove_from_guild_list", guild_id, attribute, value)
+
+    async def upsert_spaces(self, rows):
+        await self.defer("upsert_spaces", rows)
+
+    async def update_spaces(self, updates):
+        await self.defer("update_spaces", updates)
+
+    async def prune_spaces(self, space_ids, guilds, owners):
+        await self.defer("prune_spaces", space_ids, guilds, owners)
+
+    async def record_activity(self, rows):
+        await self.defer("record_activity", rows)